@@ -0,0 +1,152 @@
+"""
+Benchmarks the operations of :class:`galerts.GAlertsManager` against
+``bench/mockserver.py`` for accounts of different sizes::
+
+    $ python bench/benchmark.py --sizes 10,1000,100000 --latency 0.01
+
+For each operation, reports how many requests it sent, the wall time it
+took, and for listings, how much of that was spent parsing. Each account
+size is benchmarked in a fresh process so that the peak memory use reported
+for it is its own.
+"""
+
+import json
+import optparse
+import os
+import resource
+import subprocess
+import sys
+import time
+import urllib
+import urllib2
+from StringIO import StringIO
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, os.pardir))
+import galerts
+import mockserver
+
+
+def requests_served(url):
+    return json.load(urllib2.urlopen(url + '/_stats'))['requests']
+
+
+def measure(url, name, func, results):
+    before = requests_served(url)
+    start = time.time()
+    func()
+    wall = time.time() - start
+    results.append({
+        'op': name,
+        'requests': requests_served(url) - before,
+        'wall': wall,
+        })
+    return results[-1]
+
+
+def run(url, size):
+    """
+    Runs the benchmarks against the mock server at *url* and returns the
+    results.
+    """
+    results = []
+    managers = []
+    def signin():
+        managers.append(galerts.GAlertsManager('test@gmail.com',
+            mockserver.PASSWORD, accounts_url=url, alerts_url=url))
+    measure(url, 'sign in', signin, results)
+    gam = managers[0]
+
+    alerts = []
+    measure(url, 'list alerts', lambda: alerts.extend(gam.alerts), results)
+    assert len(alerts) == size, (len(alerts), size)
+    measure(url, 'list alerts (cached)', lambda: list(gam.alerts), results)
+    measure(url, 'first alert', lambda: next(iter(gam.alerts)), results)
+    gam.invalidate_cache()
+    measure(url, 'list alerts (revalidated)', lambda: list(gam.alerts),
+        results)
+    gam.invalidate_cache()
+    measure(url, 'first alert (uncached)', lambda: next(iter(gam.alerts)),
+        results)
+
+    # time parsing alone, on a page that's already been downloaded
+    response = gam._open(url + '/alerts/manage?hl=en&gl=us')
+    page = response.read()
+    def parse():
+        fp = urllib.addinfourl(StringIO(page), response.info(), url)
+        list(gam._parse_alerts(fp))
+    result = measure(url, 'parse alerts page', parse, results)
+    result['bytes'] = len(page)
+
+    measure(url, 'create', lambda: gam.create('benchmark', galerts.TYPE_NEWS),
+        results)
+    alert = alerts[0]
+    alert.query = 'benchmark'
+    measure(url, 'update', lambda: gam.update(alert), results)
+    measure(url, 'update (unchanged)', lambda: gam.update(alert), results)
+    measure(url, 'delete', lambda: gam.delete(alerts[-1]), results)
+
+    batch = [{'query': 'batch %d' % i, 'type': galerts.TYPE_NEWS}
+        for i in xrange(20)]
+    measure(url, 'create_many (20)', lambda: gam.create_many(batch), results)
+    measure(url, 'delete_many (10)', lambda: gam.delete_many(alerts[1:11]),
+        results)
+    gam.close()
+    return results
+
+
+def child(url, size):
+    results = run(url, size)
+    print json.dumps({
+        'results': results,
+        # kilobytes on Linux, bytes on Mac OS X
+        'maxrss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        })
+
+
+def benchmark(size, latency, page_size=None):
+    args = [sys.executable, os.path.join(HERE, 'mockserver.py'),
+        '--alerts', str(size), '--latency', str(latency)]
+    if page_size:
+        args += ['--page-size', str(page_size)]
+    server = subprocess.Popen(args, stdout=subprocess.PIPE)
+    try:
+        url = server.stdout.readline().strip()
+        output = subprocess.check_output([sys.executable, __file__,
+            '--child', url, '--sizes', str(size)])
+    finally:
+        server.terminate()
+        server.wait()
+    return json.loads(output)
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--sizes', default='10,1000,100000',
+        help='comma-separated numbers of alerts to benchmark with '
+            '(default: %default)')
+    parser.add_option('--latency', type='float', default=0,
+        help='seconds the mock server waits before answering each request '
+            '(default: %default)')
+    parser.add_option('--page-size', type='int', default=None,
+        help='number of alerts the mock server lists per manage page '
+            '(default: all)')
+    parser.add_option('--child', metavar='URL', help=optparse.SUPPRESS_HELP)
+    options, args = parser.parse_args()
+    sizes = [int(size) for size in options.sizes.split(',')]
+    if options.child:
+        return child(options.child, sizes[0])
+
+    print '%-26s %8s %9s %10s' % ('operation', 'requests', 'wall (ms)',
+        'size (KB)')
+    for size in sizes:
+        report = benchmark(size, options.latency, options.page_size)
+        print '\n%d alerts (peak memory: %.1f MB)' % (size,
+            report['maxrss'] / 1024.0)
+        for result in report['results']:
+            print '%-26s %8d %9.1f %10s' % (result['op'], result['requests'],
+                result['wall'] * 1000, '%.1f' % (result['bytes'] / 1024.0)
+                if 'bytes' in result else '')
+
+if __name__ == '__main__':
+    main()
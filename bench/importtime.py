@@ -0,0 +1,90 @@
+"""
+Measures how long ``import galerts`` takes, and what it imports, for
+scripts that use different parts of the module::
+
+    $ python bench/importtime.py --runs 20
+
+Each scenario is run in a fresh interpreter, so every import is a cold
+import, and the median of its runs is reported. Scripts that only use the
+constants or :class:`galerts.Alert` shouldn't pay for the network and
+parsing modules, so if any of those scenarios imports one of
+:data:`HEAVY_MODULES`, the heavy modules it imported are listed and the
+script exits with status 1.
+"""
+
+import optparse
+import os
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+#: Modules which galerts only imports once they're needed.
+HEAVY_MODULES = ('BeautifulSoup', 'HTMLParser', 'cookielib', 'csv',
+    'email.utils', 'httplib', 'json', 'multiprocessing.dummy', 'socket',
+    'threading', 'urllib', 'urllib2', 'xml.etree.cElementTree')
+
+#: (name, code, whether it must not import any of :data:`HEAVY_MODULES`)
+SCENARIOS = (
+    ('python', 'pass', True),
+    ('constants', 'galerts.TYPE_NEWS, galerts.ALERT_FREQS', True),
+    ('Alert model', 'a = galerts.Alert("me@gmail.com", "s", u"q", '
+        'galerts.TYPE_NEWS, galerts.FREQ_ONCE_A_DAY, galerts.VOL_ALL, '
+        'galerts.DELIVER_EMAIL); a.query = "r"; str(a)', True),
+    ('alerts parser', 'galerts._AlertsParser()', False),
+    ('network stack', 'galerts.urllib2.build_opener('
+        'galerts._RedirectHandler())', False),
+    )
+
+CHILD = '''
+import sys, time
+sys.path.insert(0, %(root)r)
+before = set(sys.modules)
+start = time.time()
+%(import)s
+%(code)s
+elapsed = time.time() - start
+imported = [m for m in %(heavy)r if m in sys.modules and m not in before]
+print elapsed * 1000, ' '.join(imported)
+'''
+
+
+def run(code, runs):
+    """
+    Runs *code* after importing galerts in *runs* fresh interpreters and
+    returns the median time it took and the heavy modules it imported.
+    """
+    source = CHILD % {
+        'root': os.path.join(HERE, os.pardir),
+        'import': 'import galerts' if code != 'pass' else '',
+        'code': code,
+        'heavy': HEAVY_MODULES,
+        }
+    times = []
+    for i in xrange(runs):
+        output = subprocess.check_output([sys.executable, '-c', source])
+        ms, heavy = output.split(None, 1) if ' ' in output.strip() \
+            else (output, '')
+        times.append(float(ms))
+    times.sort()
+    return times[len(times) // 2], heavy.split()
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--runs', type='int', default=10,
+        help='number of fresh interpreters to time each scenario in '
+            '(default: %default)')
+    options, args = parser.parse_args()
+
+    status = 0
+    print '%-16s %9s  %s' % ('scenario', 'time (ms)', 'heavy modules imported')
+    for name, code, light in SCENARIOS:
+        ms, heavy = run(code, options.runs)
+        print '%-16s %9.1f  %s' % (name, ms, ', '.join(heavy))
+        if light and heavy:
+            status = 1
+    return status
+
+if __name__ == '__main__':
+    sys.exit(main())
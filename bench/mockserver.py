@@ -0,0 +1,509 @@
+"""
+A local stand-in for the parts of Google Accounts and Google Alerts that
+galerts talks to, for exercising and benchmarking galerts without touching
+Google. Serves the sign in, manage, edit, create, and save pages for one
+account with a configurable number of alerts, optionally split over several
+manage pages, and added latency, as well as the feeds of its feed alerts,
+which gain new results every so often. Pages are gzipped for clients that
+accept it, and have ETags, so unchanged pages can be answered with
+"304 Not Modified"::
+
+    $ python bench/mockserver.py --alerts 1000 --latency 0.05
+    http://127.0.0.1:54321
+
+Point a manager at the printed url::
+
+    >>> gam = galerts.GAlertsManager('test@gmail.com', 'secret',
+    ...     accounts_url='http://127.0.0.1:54321',
+    ...     alerts_url='http://127.0.0.1:54321')
+
+``GET /_stats`` returns counts of the requests served so far, and of the
+bytes of the response bodies sent, as JSON, and
+:meth:`MockServer.fail` makes the server answer requests with errors, for
+testing how they're retried.
+"""
+
+import BaseHTTPServer
+import SocketServer
+import cgi
+import email.utils
+import itertools
+import json
+import optparse
+import os
+import socket
+import sys
+import threading
+import time
+import urlparse
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import galerts
+
+FREQ_CODES = dict((v, k) for (k, v) in galerts.ALERT_FREQS.iteritems())
+VOL_CODES = dict((v, k) for (k, v) in galerts.ALERT_VOLS.iteritems())
+TYPE_CODES = dict((v, k) for (k, v) in galerts.ALERT_TYPES.iteritems())
+
+PASSWORD = 'secret'
+SESSION = 'mock-session'
+SIG = 'AMJHsmVfd3Zt2fYsRkD9'
+
+
+class Account(object):
+    """
+    The alerts of the one account the server knows about, listed
+    *page_size* to a manage page if given. A new result is published to the
+    feed of the *n*\ th alert every ``feed_period * (1 + n % 4)`` seconds.
+    """
+    def __init__(self, email, nalerts, page_size=None, feed_period=60):
+        self.email = email
+        self.alerts = {}
+        self.page_size = page_size
+        self.feed_period = feed_period
+        # base url of the server, for the feed urls
+        self.base_url = 'http://www.google.com'
+        self._ids = itertools.count(1)
+        # incremented on every change, for the manage pages' ETags
+        self.version = 0
+        # start -> [page, gzipped page]
+        self._pages = {}
+        self._listed = []
+        self._lock = threading.Lock()
+        for i in xrange(nalerts):
+            self.add(u'alert %d' % i, galerts.ALERT_TYPES.values()[i % 6],
+                galerts.ALERT_FREQS[galerts.FREQ_ONCE_A_DAY],
+                galerts.ALERT_VOLS[galerts.VOL_ONLY_BEST],
+                galerts.DELIVER_FEED if i % 2 else email)
+
+    def add(self, query, type, freq, vol, deliver):
+        with self._lock:
+            s = 'Mock%08d' % next(self._ids)
+            if deliver == galerts.DELIVER_FEED:
+                freq = galerts.ALERT_FREQS[galerts.FREQ_AS_IT_HAPPENS]
+            self.alerts[s] = dict(query=query, type=type, freq=freq, vol=vol,
+                deliver=deliver)
+            self._changed()
+            return s
+
+    def save(self, s, **values):
+        with self._lock:
+            alert = self.alerts.get(s)
+            if alert is None:
+                return False
+            alert.update((k, v) for (k, v) in values.iteritems()
+                if v is not None)
+            if alert['deliver'] == galerts.DELIVER_FEED:
+                alert['freq'] = galerts.ALERT_FREQS[galerts.FREQ_AS_IT_HAPPENS]
+            self._changed()
+            return True
+
+    def delete(self, s):
+        with self._lock:
+            self._changed()
+            return self.alerts.pop(s, None) is not None
+
+    def _changed(self):
+        self.version += 1
+        self._pages.clear()
+
+    def manage_page(self, start=0, gzipped=False):
+        """
+        Returns the manage page listing the alerts from the *start*\ th on,
+        gzipped if *gzipped* is true, and its ETag. Pages are only
+        regenerated after changes.
+        """
+        with self._lock:
+            page = self._pages.get(start)
+            if page is None:
+                if not self._pages:
+                    self._listed = sorted(self.alerts)
+                page = self._pages[start] = [
+                    self._render_manage_page(start), None]
+            if gzipped and page[1] is None:
+                page[1] = gzip(page[0])
+            return page[1 if gzipped else 0], '"%d-%d"' % (self.version,
+                start)
+
+    def _render_manage_page(self, start):
+        rows = []
+        listed = self._listed
+        end = len(listed)
+        if self.page_size:
+            end = min(end, start + self.page_size)
+        for s in listed[start:end]:
+            alert = self.alerts[s]
+            if alert['deliver'] == galerts.DELIVER_FEED:
+                deliver = ('<a href="/alerts/feedhelp">Feed</a> '
+                    '<a href="%s/alerts/feeds/01234567890123456789/%s" '
+                    'class="feed"><img src="/feed.gif" alt="Feed"></a>'
+                    % (self.base_url, s))
+            else:
+                deliver = cgi.escape(self.email)
+            rows.append(
+                '<tr class="ACTIVE">'
+                '<td class="check"><input type="checkbox" name="s" '
+                'value="%s"></td>'
+                '<td class="query"><a href="/alerts/edit?hl=en&amp;gl=us&amp;'
+                's=%s">%s</a></td>'
+                '<td class="vol">%s</td>'
+                '<td class="freq">%s</td>'
+                '<td class="deliver">%s</td>'
+                '<td class="type">%s</td>'
+                '<td class="edit"><a href="/alerts/edit?hl=en&amp;gl=us&amp;'
+                's=%s">Edit</a></td>'
+                '</tr>\n' % (s, s,
+                    cgi.escape(alert['query'], True).encode('utf-8'),
+                    VOL_CODES[alert['vol']], FREQ_CODES[alert['freq']],
+                    deliver, TYPE_CODES[alert['type']], s))
+        if not rows:
+            rows.append('<tr class="data_row"><td colspan="7">'
+                'You have no Google Alerts.</td></tr>\n')
+        pages = ''
+        if end < len(listed):
+            pages = ('<div class="pages"><a href="/alerts/manage?hl=en&amp;'
+                'gl=us&amp;start=%d">Next &rsaquo;</a></div>' % end)
+        return (PAGE % (
+            '<form action="/alerts/save?hl=en&amp;gl=us" method="post">'
+            '<input type="hidden" name="x" value="%s">'
+            '<input type="hidden" name="e" value="%s">'
+            '<table class="alerts" cellpadding="0" cellspacing="0">'
+            '<tr><th></th><th>Search terms</th><th>Volume</th>'
+            '<th>How often</th><th>Deliver to</th><th>Type</th><th></th></tr>\n'
+            '%s</table>'
+            '<input type="submit" name="da" value="Delete"></form>%s'
+            % (SIG, cgi.escape(self.email), ''.join(rows), pages)))
+
+
+    def feed(self, s):
+        """
+        Returns the Atom feed of the feed alert *s*, its ETag, and the time
+        it was last modified, or ``None`` if there is no such alert.
+        """
+        alert = self.alerts.get(s)
+        if alert is None or alert['deliver'] != galerts.DELIVER_FEED:
+            return None
+        n = int(s[len('Mock'):])
+        period = self.feed_period * (1 + n % 4)
+        latest = int(time.time() / period)
+        modified = latest * period
+        entries = [(('%d-%d' % (n, gen)), 'Result %d of alert %d' % (gen, n),
+            gen * period) for gen in xrange(latest, latest - 5, -1)]
+        # neighboring alerts share a result
+        entries.append(('shared-%d' % (n // 2), 'Result shared by alerts',
+            modified))
+        body = FEED % (cgi.escape(alert['query']).encode('utf-8'),
+            self.base_url, s, _atom_date(modified), ''.join(ENTRY % (
+                id, cgi.escape(title), self.base_url, id,
+                _atom_date(published), _atom_date(published),
+                cgi.escape('<b>%s</b>' % title))
+            for (id, title, published) in entries))
+        return body, '"%d-%d"' % (n, latest), modified
+
+
+PAGE = '''<!DOCTYPE html>
+<html><head><meta http-equiv="content-type" content="text/html; charset=UTF-8">
+<title>Google Alerts</title>
+<style>body{font-family:arial,sans-serif}td{padding:2px 8px}</style>
+<script>function check(f){for(var i=0;i<f.elements.length;i++)
+f.elements[i].checked=true;}</script>
+</head><body><div id="gbar"><b>Alerts</b> <a href="/">Web</a>
+<a href="/news">News</a></div><div id="main">%s</div>
+<div id="footer">&copy;2011 Google - <a href="/privacy">Privacy</a></div>
+</body></html>
+'''
+
+
+def gzip(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _atom_date(t):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(t))
+
+
+FEED = '''<?xml version="1.0" encoding="utf-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom"><id>tag:google.com,2005:reference:feed</id>
+<title>Google Alert - %s</title>
+<link href="%s/alerts/feeds/01234567890123456789/%s" rel="self"></link>
+<updated>%s</updated>
+%s</feed>
+'''
+
+ENTRY = ('<entry><id>tag:google.com,2013:googlealerts/feed:%s</id>'
+    '<title type="html">%s</title><link href="%s/url?q=result-%s"></link>'
+    '<published>%s</published><updated>%s</updated>'
+    '<content type="html">%s</content><author><name></name></author>'
+    '</entry>\n')
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # send each response in as few packets as possible, so the benchmarks
+    # don't measure delayed ACKs
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def accepts_gzip(self):
+        return self.server.gzip and \
+            'gzip' in (self.headers.get('Accept-Encoding') or '')
+
+    def respond(self, body='', status=200, headers=(), etag=None,
+            gzipped=None):
+        """
+        Sends *body*, or "304 Not Modified" if the client has the version
+        with *etag* already. If the client accepts gzip, *body* is sent
+        gzipped, as *gzipped* if that's given.
+        """
+        headers = list(headers)
+        if etag is not None:
+            headers.append(('ETag', etag))
+            if self.headers.get('If-None-Match') == etag:
+                status, body = 304, ''
+        if body and status != 304 and self.accepts_gzip():
+            body = gzipped if gzipped is not None else gzip(body)
+            headers.append(('Content-Encoding', 'gzip'))
+        with self.server.stats_lock:
+            self.server.stats['bytes'] += len(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in headers:
+            self.send_header(k, v)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def redirect(self, location, headers=()):
+        self.respond('', 302, [('Location', location)] + list(headers))
+
+    def signed_in(self):
+        return 'SID=%s' % SESSION in (self.headers.get('Cookie') or '')
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        with self.server.stats_lock:
+            self.server.stats['connections'] += 1
+
+    def count(self, name):
+        with self.server.stats_lock:
+            self.server.stats['requests'] += 1
+            self.server.stats[name] = self.server.stats.get(name, 0) + 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+    def fail(self, path):
+        """
+        Answers the request for *path* with the next of the server's queued
+        failures for it, if any, and returns whether it did.
+        """
+        with self.server.stats_lock:
+            failures = self.server.failures
+            i = next((i for (i, failure) in enumerate(failures)
+                if failure[0] in (None, path)), None)
+            if i is None:
+                return False
+            path, status, retry_after = failures.pop(i)
+        headers = []
+        if retry_after is not None:
+            headers.append(('Retry-After', str(retry_after)))
+        self.respond('Try again later', status, headers)
+        return True
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        query = dict(urlparse.parse_qsl(url.query))
+        if url.path == '/_stats':
+            with self.server.stats_lock:
+                stats = json.dumps(self.server.stats)
+            return self.respond(stats)
+        if url.path.startswith('/alerts/feeds/'):
+            return self.feed(url.path.rsplit('/', 1)[-1])
+        self.count('GET ' + url.path)
+        if self.fail(url.path):
+            return
+        account = self.server.account
+        if url.path == '/ServiceLogin':
+            return self.respond(PAGE % (
+                '<form action="/ServiceLoginAuth" method="post">'
+                '<input type="hidden"  name="continue" value="%s">\n'
+                '<input name="GALX" type="hidden"\n'
+                '         value="mock-galx">\n'
+                '<input type="text" name="Email">'
+                '<input type="password" name="Passwd"></form>'
+                % cgi.escape(query.get('continue', ''))))
+        if url.path in ('/alerts', '/alerts/manage'):
+            if url.path == '/alerts/manage' and not self.signed_in():
+                return self.redirect('/ServiceLogin?continue=%s' % self.path)
+            start = int(query.get('start', 0))
+            page, etag = account.manage_page(start)
+            gzipped = None
+            if self.accepts_gzip():
+                gzipped, etag = account.manage_page(start, True)
+            return self.respond(page, etag=etag, gzipped=gzipped)
+        if url.path == '/alerts/edit':
+            if not self.signed_in():
+                return self.redirect('/ServiceLogin')
+            if query.get('s') not in account.alerts:
+                return self.respond('No such alert', 404)
+            return self.respond(PAGE % (
+                '<form action="/alerts/save?hl=en&amp;gl=us" method="post">'
+                '<input type="hidden" name="x" value="%s">'
+                '<input type="hidden" name="es" value="es-%s">'
+                '<input type="hidden" name="hps" value="hps-%s">'
+                '<input type="text" name="q"></form>'
+                % (SIG, query['s'], query['s'])),
+                etag='"edit-%s"' % query['s'])
+        self.respond('Not found', 404)
+
+    def feed(self, s):
+        self.count('GET /alerts/feeds')
+        feed = self.server.account.feed(s)
+        if feed is None:
+            return self.respond('Not found', 404)
+        body, etag, modified = feed
+        headers = [('ETag', etag),
+            ('Last-Modified', email.utils.formatdate(modified, usegmt=True))]
+        since = self.headers.get('If-Modified-Since')
+        since = since and email.utils.parsedate_tz(since)
+        if self.headers.get('If-None-Match') == etag or (since and
+                email.utils.mktime_tz(since) >= int(modified)):
+            return self.respond('', 304, headers)
+        self.respond(body, headers=headers)
+
+    def do_POST(self):
+        url = urlparse.urlparse(self.path)
+        self.count('POST ' + url.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        form = dict(urlparse.parse_qsl(self.rfile.read(length)))
+        if self.fail(url.path):
+            return
+        account = self.server.account
+        if url.path == '/ServiceLoginAuth':
+            if form.get('Email') != account.email or \
+                    form.get('Passwd') != PASSWORD or \
+                    form.get('GALX') != 'mock-galx':
+                return self.respond('Wrong password', 403)
+            return self.redirect(form.get('continue') or '/alerts/manage',
+                [('Set-Cookie', 'SID=%s; Path=/' % SESSION)])
+        if not self.signed_in():
+            return self.redirect('/ServiceLogin')
+        if form.get('x') != SIG:
+            return self.respond('Bad request', 400)
+        if url.path == '/alerts/create':
+            account.add(form.get('q', '').decode('utf-8'), form.get('t'),
+                form.get('f'), form.get('l'), form.get('e'))
+            if self.server.redirect_creates:
+                return self.redirect('/alerts/manage?hl=en&gl=us')
+            return self.respond(PAGE % 'Your alert has been created.')
+        if url.path == '/alerts/save':
+            if form.get('da') == 'Delete':
+                found = account.delete(form.get('s'))
+            else:
+                s = form.get('es', '')[len('es-'):]
+                found = account.save(s,
+                    query=form.get('q', '').decode('utf-8') or None,
+                    type=form.get('t'), freq=form.get('f'),
+                    vol=form.get('l'),
+                    deliver=galerts.DELIVER_FEED
+                        if form.get('d') == galerts.DELIVER_DEFAULT_VAL
+                        else account.email)
+            if not found:
+                return self.respond('No such alert', 404)
+            return self.redirect('/alerts/manage?hl=en&gl=us')
+        self.respond('Not found', 404)
+
+
+class MockServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Serves one account, *email*, with password :data:`PASSWORD` and
+    *alerts* alerts, listed *page_size* to a page if given, waiting
+    *latency* seconds before answering each request. See :class:`Account`
+    for *feed_period*. Pass ``gzip=False`` to never compress responses,
+    and ``redirect_creates=True`` to answer creations with a redirect to the
+    manage page, as Google may, rather than a page of their own.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=('127.0.0.1', 0), email='test@gmail.com',
+            alerts=10, latency=0, page_size=None, feed_period=60,
+            gzip=True, redirect_creates=False):
+        BaseHTTPServer.HTTPServer.__init__(self, address, Handler)
+        self.gzip = gzip
+        self.redirect_creates = redirect_creates
+        self.account = Account(email, alerts, page_size, feed_period)
+        self.account.base_url = self.url
+        self.latency = latency
+        self.stats = {'requests': 0, 'connections': 0, 'bytes': 0}
+        self.stats_lock = threading.Lock()
+        # (path, status, Retry-After) of the next requests to fail
+        self.failures = []
+
+    def handle_error(self, request, client_address):
+        # clients hanging up early, e.g. after reading the first few alerts
+        # of a listing, are expected
+        if not isinstance(sys.exc_info()[1], socket.error):
+            BaseHTTPServer.HTTPServer.handle_error(self, request,
+                client_address)
+
+    def fail(self, status=503, times=1, retry_after=None, path=None):
+        """
+        Answers the next *times* requests for *path* (or for anything but
+        feeds and ``/_stats`` if not given) with *status*, and a Retry-After
+        header of *retry_after* seconds if given, without acting on them.
+        """
+        with self.stats_lock:
+            self.failures.extend([(path, status, retry_after)] * times)
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address
+
+    def start(self):
+        """
+        Serves requests from a background thread.
+        """
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--port', type='int', default=0,
+        help='port to listen on (default: any free port)')
+    parser.add_option('--email', default='test@gmail.com',
+        help='email address of the account (default: %default)')
+    parser.add_option('--alerts', type='int', default=10,
+        help='number of alerts the account starts with (default: %default)')
+    parser.add_option('--latency', type='float', default=0,
+        help='seconds to wait before answering each request '
+            '(default: %default)')
+    parser.add_option('--page-size', type='int', default=None,
+        help='number of alerts to list per manage page (default: all)')
+    parser.add_option('--feed-period', type='float', default=60,
+        help='base number of seconds between new results in each feed '
+            '(default: %default)')
+    parser.add_option('--no-gzip', dest='gzip', action='store_false',
+        default=True, help="don't compress responses")
+    parser.add_option('--redirect-creates', action='store_true',
+        default=False, help='redirect to the manage page after creations')
+    options, args = parser.parse_args()
+    server = MockServer(('127.0.0.1', options.port), options.email,
+        options.alerts, options.latency, options.page_size,
+        options.feed_period, options.gzip, options.redirect_creates)
+    print server.url
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
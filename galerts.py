@@ -21,11 +21,79 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
 # OTHER DEALINGS IN THE SOFTWARE.
 
+import codecs
+import os
+import heapq
 import re
-import urllib2
-from BeautifulSoup import BeautifulSoup
-from getpass import getpass
-from urllib import urlencode
+import sys
+import time
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
+from itertools import compress, islice
+from operator import itemgetter
+
+try:
+    import fcntl
+except ImportError: # not available on Windows
+    fcntl = None
+
+
+class _LazyModule(object):
+    """
+    Stands in for the module *name*, which is only imported when one of its
+    attributes is first used. Importing the network and parsing modules
+    would otherwise make up most of the time it takes to import galerts,
+    which is wasted on scripts that only need the constants or
+    :class:`Alert`.
+    """
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        __import__(self._name)
+        module = sys.modules[self._name]
+        return getattr(module, attr)
+
+    def __repr__(self):
+        return '<lazy module %r>' % self._name
+
+
+class _LazyClass(object):
+    """
+    Stands in for the class returned by *define*, which is only called to
+    define it (importing the modules it subclasses from) when the class is
+    first instantiated.
+    """
+    def __init__(self, define):
+        self._define = define
+        self._cls = None
+
+    def __call__(self, *args, **kwds):
+        if self._cls is None:
+            self._cls = self._define()
+        return self._cls(*args, **kwds)
+
+cookielib = _LazyModule('cookielib')
+csv = _LazyModule('csv')
+httplib = _LazyModule('httplib')
+json = _LazyModule('json')
+Queue = _LazyModule('Queue')
+random = _LazyModule('random')
+socket = _LazyModule('socket')
+threading = _LazyModule('threading')
+urllib = _LazyModule('urllib')
+urllib2 = _LazyModule('urllib2')
+urlparse = _LazyModule('urlparse')
+
+def ThreadPool(processes=None):
+    """
+    Returns a ``multiprocessing.dummy.Pool`` of *processes* worker threads.
+    """
+    from multiprocessing.dummy import Pool
+    return Pool(processes)
 
 
 # {{{ these values must match those used in the Google Alerts web interface:
@@ -90,6 +158,16 @@ ALERT_TYPES = {
     }
 # }}}
 
+# :class:`Alert` stores the values Google uses rather than our names for them
+_DELIVER_NAMES = dict((v, k) for (k, v) in DELIVER_TYPES.iteritems())
+_FREQ_NAMES = dict((v, k) for (k, v) in ALERT_FREQS.iteritems())
+_VOL_NAMES = dict((v, k) for (k, v) in ALERT_VOLS.iteritems())
+_TYPE_NAMES = dict((v, k) for (k, v) in ALERT_TYPES.iteritems())
+
+# bits of :attr:`Alert._modified`
+_MODIFIABLE = ('query', 'type', 'freq', 'vol', 'deliver')
+_QUERY, _TYPE, _FREQ, _VOL, _DELIVER = (1 << i for i in range(len(_MODIFIABLE)))
+
 class SignInError(Exception):
     """
     Raised when Google sign in fails.
@@ -105,6 +183,69 @@ class UnexpectedResponseError(Exception):
         self.resp_headers = headers
         self.resp_body = body
 
+class CircuitOpenError(Exception):
+    """
+    Raised instead of sending a request while a :class:`CircuitBreaker` is
+    shedding load after repeated failures. :attr:`retry_after` is the number
+    of seconds until a request will be let through again.
+    """
+    def __init__(self, retry_after):
+        Exception.__init__(self, 'Too many failures; retry in %.1f seconds'
+            % retry_after)
+        self.retry_after = retry_after
+
+def _unescape(value):
+    """
+    Replaces the character references in *value* with the characters.
+    """
+    from HTMLParser import HTMLParser
+    return HTMLParser().unescape(value)
+
+def _retry_after(headers):
+    """
+    Returns the number of seconds the Retry-After header in *headers* asks
+    us to wait, or ``None`` if there is no such (valid) header.
+    """
+    value = headers.get('Retry-After')
+    if not value:
+        return None
+    from email.utils import mktime_tz, parsedate_tz
+    try:
+        return max(0, int(value))
+    except ValueError:
+        date = parsedate_tz(value)
+        if date is None:
+            return None
+        return max(0, mktime_tz(date) - time.time())
+
+def _validators(response):
+    """
+    Returns the ``(etag, last_modified)`` validators of *response*, or
+    ``None`` if it has neither.
+    """
+    info = response.info()
+    etag, modified = info.get('ETag'), info.get('Last-Modified')
+    if etag or modified:
+        return etag, modified
+    return None
+
+def _conditional_headers(validators):
+    """
+    Returns the headers making a request conditional on the resource having
+    changed since it had the ``(etag, last_modified)`` *validators*.
+    """
+    headers = {}
+    etag, modified = validators or (None, None)
+    if etag:
+        headers['If-None-Match'] = etag
+    if modified:
+        headers['If-Modified-Since'] = modified
+    return headers
+
+_INPUT_RE = re.compile(r'<input\b[^>]*>', re.IGNORECASE)
+_ATTR_RE = re.compile(
+    r'''([\w:-]+)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))''')
+
 def safe_urlencode(params):
     result = []
     for k, v in params.iteritems():
@@ -113,7 +254,7 @@ def safe_urlencode(params):
         if not isinstance(v, str):
             v = v.encode('utf-8')
         result.append((k, v))
-    return urlencode(result)
+    return urllib.urlencode(result)
 
 class Alert(object):
     """
@@ -127,6 +268,12 @@ class Alert(object):
     :attr:`GAlertsManager.alerts` you'll find an :class:`Alert` object there
     for the alert you just created.
     """
+    # Alerts are kept in bulk, so keep them small: no instance dicts, and the
+    # enumerated properties are stored as the values Google uses for them,
+    # which are shared by all alerts
+    __slots__ = ('_email', '_s', '_query', '_type', '_freq', '_vol',
+        '_deliver', '_feedurl', '_modified')
+
     def __init__(self, email, s, query, type, freq, vol, deliver, feedurl=None):
         assert type in ALERT_TYPES
         assert freq in ALERT_FREQS
@@ -135,11 +282,26 @@ class Alert(object):
         self._email = email
         self._s = s
         self._query = query
-        self._type = type
-        self._freq = freq
-        self._vol = vol
-        self._deliver = deliver
+        self._type = ALERT_TYPES[type]
+        self._freq = ALERT_FREQS[freq]
+        self._vol = ALERT_VOLS[vol]
+        self._deliver = DELIVER_TYPES[deliver]
         self._feedurl = feedurl
+        self._modified = 0
+
+    def _copy(self):
+        copy = object.__new__(self.__class__)
+        for attr in Alert.__slots__:
+            setattr(copy, attr, getattr(self, attr))
+        copy._modified = 0
+        return copy
+
+    def __getstate__(self):
+        return dict((attr, getattr(self, attr)) for attr in Alert.__slots__)
+
+    def __setstate__(self, state):
+        for attr, value in state.iteritems():
+            setattr(self, attr, value)
 
     def _query_get(self):
         return self._query
@@ -154,6 +316,8 @@ class Alert(object):
             except UnicodeDecodeError:
                 raise ValueError('Illegal value for Alert.query ' \
                     '(unicode(value) failed): %r' % value)
+        if value != self._query:
+            self._modified |= _QUERY
         self._query = value
 
     query = property(_query_get, _query_set, doc="""\
@@ -164,11 +328,14 @@ class Alert(object):
         """)
 
     def _deliver_get(self):
-        return self._deliver
+        return _DELIVER_NAMES[self._deliver]
 
     def _deliver_set(self, value):
         if value not in DELIVER_TYPES:
             raise ValueError('Illegal value for Alert.deliver: %r' % value)
+        value = DELIVER_TYPES[value]
+        if value != self._deliver:
+            self._modified |= _DELIVER
         self._deliver = value
 
     deliver = property(_deliver_get, _deliver_set, doc="""\
@@ -178,11 +345,14 @@ class Alert(object):
         """)
 
     def _freq_get(self):
-        return self._freq
+        return _FREQ_NAMES[self._freq]
 
     def _freq_set(self, value):
         if value not in ALERT_FREQS:
             raise ValueError('Illegal value for Alert.freq: %r' % value)
+        value = ALERT_FREQS[value]
+        if value != self._freq:
+            self._modified |= _FREQ
         self._freq = value
 
     freq = property(_freq_get, _freq_set, doc="""\
@@ -192,11 +362,14 @@ class Alert(object):
         """)
 
     def _vol_get(self):
-        return self._vol
+        return _VOL_NAMES[self._vol]
 
     def _vol_set(self, value):
         if value not in ALERT_VOLS:
             raise ValueError('Illegal value for Alert.vol: %r' % value)
+        value = ALERT_VOLS[value]
+        if value != self._vol:
+            self._modified |= _VOL
         self._vol = value
 
     vol = property(_vol_get, _vol_set, doc="""\
@@ -206,11 +379,14 @@ class Alert(object):
         """)
 
     def _type_get(self):
-        return self._type
+        return _TYPE_NAMES[self._type]
 
     def _type_set(self, value):
         if value not in ALERT_TYPES:
             raise ValueError('Illegal value for Alert.type: %r' % value)
+        value = ALERT_TYPES[value]
+        if value != self._type:
+            self._modified |= _TYPE
         self._type = value
 
     type = property(_type_get, _type_set, doc="""\
@@ -219,6 +395,17 @@ class Alert(object):
         :raises ValueError: if value is not in :attr:`ALERT_TYPES`
         """)
 
+    @property
+    def modified(self):
+        """
+        Returns the set of the names of the properties (``'query'``,
+        ``'type'``, ``'freq'``, ``'vol'``, ``'deliver'``) that have been
+        changed since this alert was loaded from Google or last saved with
+        :meth:`GAlertsManager.update`.
+        """
+        return frozenset(name for (i, name) in enumerate(_MODIFIABLE)
+            if self._modified & 1 << i)
+
     @property
     def email(self):
         """
@@ -242,6 +429,12 @@ class Alert(object):
         """
         return self._feedurl
 
+    def _key(self):
+        """
+        Returns what identifies this alert to :meth:`GAlertsManager.sync`.
+        """
+        return (unicode(self._query), self._type, self._deliver)
+
     def __hash__(self):
         return hash((self._s, self.query, self.type, self.freq, self.deliver,
             self._feedurl))
@@ -260,6 +453,792 @@ class Alert(object):
             self.query.encode('utf-8'), self.type, self.freq, self.deliver)
 
 
+class _FileLock(object):
+    """
+    Context manager holding an exclusive lock on the file at *path*, which
+    is created if necessary, to serialize access to a resource shared by
+    several processes. Where :mod:`fcntl` is unavailable, no lock is taken.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def __enter__(self):
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0600)
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+
+
+class TokenBucket(object):
+    """
+    Limits the rate of some operation to *rate* operations per second on
+    average, allowing bursts of up to *burst* operations. Thread-safe.
+
+    Pass one to a :class:`GAlertsManager` as one of its *rate_limiters* to
+    limit the rate of its requests, or to several managers to limit the
+    rate of their requests combined.
+    """
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = burst
+        self._tokens = float(burst)
+        self._time = time.time()
+        self._lock = threading.Lock()
+
+    def _locked(self):
+        return self._lock
+
+    def _refill(self):
+        now = time.time()
+        self._tokens = min(self.burst,
+            self._tokens + (now - self._time) * self.rate)
+        self._time = now
+
+    def delay(self):
+        """
+        Returns the number of seconds until an operation is allowed.
+        """
+        with self._locked():
+            self._refill()
+            return max(0, (1 - self._tokens) / self.rate)
+
+    def take(self):
+        """
+        Returns whether an operation is allowed now, counting it if so.
+        """
+        with self._locked():
+            self._refill()
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def acquire(self):
+        """
+        Waits until an operation is allowed and counts it.
+        """
+        while not self.take():
+            time.sleep(self.delay())
+
+
+class FileTokenBucket(TokenBucket):
+    """
+    A :class:`TokenBucket` whose state is kept in the file at *path*, so
+    that all the processes on a machine using the same *path* share one
+    limit, e.g. on the requests made to Google from the machine. Processes
+    take turns updating the file as with the *session_file* of
+    :class:`GAlertsManager`.
+    """
+    def __init__(self, path, rate, burst=1):
+        TokenBucket.__init__(self, rate, burst)
+        self.path = path
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            with _FileLock(self.path + '.lock'):
+                try:
+                    with open(self.path) as f:
+                        tokens, last = f.read().split()
+                    self._tokens, self._time = float(tokens), float(last)
+                except (IOError, ValueError):
+                    # no state saved yet (or it's garbled); start full
+                    self._tokens, self._time = float(self.burst), time.time()
+                yield
+                with open(self.path, 'w') as f:
+                    f.write('%r %r\n' % (self._tokens, self._time))
+
+
+class RetryPolicy(object):
+    """
+    Decides which failed requests a :class:`GAlertsManager` retries, and how
+    long it waits before each retry.
+
+    A request is retried at most *retries* times, if it failed with a network
+    error or a status in *statuses*. The wait before the *n*\ th retry is
+    chosen at random between 0 and ``backoff * 2 ** n`` seconds, capped at
+    *max_backoff*, so that many clients failing at once don't all retry at
+    once. If the response has a Retry-After header, we wait at least as long
+    as it asks, or don't retry at all if that's longer than *max_backoff*.
+
+    Only operations that are safe to repeat are retried. For the operations
+    in *unsafe_ops*, which by default is just ``'create'`` since creating an
+    alert twice makes a duplicate, only a "429 Too Many Requests" response is
+    retried, since it means Google turned the request away unprocessed.
+    """
+
+    #: Default statuses indicating a transient failure.
+    STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, retries=3, backoff=0.5, max_backoff=30,
+            statuses=STATUSES, unsafe_ops=('create',)):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.statuses = frozenset(statuses)
+        self.unsafe_ops = frozenset(unsafe_ops)
+
+    def retryable(self, op, status=None):
+        """
+        Returns whether a request for operation *op* that failed with
+        *status*, or with a network error if *status* is ``None``, may be
+        retried.
+        """
+        if status is not None and status not in self.statuses:
+            return False
+        return op not in self.unsafe_ops or status == 429
+
+    def delay(self, attempt, retry_after=None):
+        """
+        Returns the number of seconds to wait before retrying a request that
+        has failed *attempt* + 1 times, or ``None`` if *retry_after* (the
+        value of the Retry-After header) is too long to wait.
+        """
+        if retry_after is not None and retry_after > self.max_backoff:
+            return None
+        delay = random.uniform(0,
+            min(self.max_backoff, self.backoff * 2 ** attempt))
+        return max(delay, retry_after or 0)
+
+
+class CircuitBreaker(object):
+    """
+    Sheds load when Google keeps failing: after *threshold* consecutive
+    failed requests, requests are refused with :class:`CircuitOpenError`
+    for *reset_timeout* seconds instead of being sent. Then a single trial
+    request is let through; if it succeeds, requests are sent as usual
+    again, otherwise they're refused for another *reset_timeout* seconds.
+    A *threshold* of 0 disables the breaker. Thread-safe.
+    """
+    def __init__(self, threshold=5, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """
+        ``'closed'`` while requests are sent as usual, ``'open'`` while
+        they're refused, or ``'half-open'`` while a trial request is allowed.
+        """
+        with self._lock:
+            if self._opened is None:
+                return 'closed'
+            if self._trial or \
+                    time.time() - self._opened < self.reset_timeout:
+                return 'open'
+            return 'half-open'
+
+    def allow(self):
+        """
+        Returns if a request may be sent now.
+
+        :raises CircuitOpenError: if requests are being refused
+        """
+        with self._lock:
+            if self._opened is None:
+                return
+            remaining = self._opened + self.reset_timeout - time.time()
+            if remaining > 0 or self._trial:
+                raise CircuitOpenError(max(remaining, 0))
+            self._trial = True
+
+    def succeeded(self):
+        with self._lock:
+            self._failures = 0
+            self._opened = None
+            self._trial = False
+
+    def abandoned(self):
+        """
+        Lets another trial request through if the one allowed was never
+        completed, without counting it as a success or failure.
+        """
+        with self._lock:
+            self._trial = False
+
+    def failed(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial or \
+                    0 < self.threshold <= self._failures:
+                self._opened = time.time()
+                self._trial = False
+
+
+class _Task(object):
+    """
+    A call scheduled by :class:`GAlertsManagerPool`. Its :meth:`get` method
+    waits for the call to finish and returns its result.
+    """
+    def __init__(self, func, args, kwds):
+        self._func = func
+        self._args = args
+        self._kwds = kwds
+        self._done = threading.Event()
+        self._value = self._exc_info = None
+
+    def run(self):
+        try:
+            self._value = self._func(*self._args, **self._kwds)
+        except Exception:
+            self._exc_info = sys.exc_info()
+        self._done.set()
+
+    def ready(self):
+        return self._done.is_set()
+
+    def get(self, timeout=None):
+        """
+        Returns the result of the call, or raises the exception it raised.
+        Waits at most *timeout* seconds if given, returning ``None`` if the
+        call still hasn't finished.
+        """
+        if not self._done.wait(timeout):
+            return None
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._value
+
+
+@_LazyClass
+def _AlertsParser():
+    from HTMLParser import HTMLParser
+    from htmlentitydefs import name2codepoint
+
+    class _AlertsParser(HTMLParser):
+        """
+        Incrementally parses the alerts manage page without building a
+        document tree. Feed it the page a chunk at a time; each time an
+        active alert's row is closed, a list of its cells is appended to
+        :attr:`rows`. Each cell is a dict with the value of the cell's first
+        input (``'input'``), the text at the start of the cell (``'text'``),
+        the text at the start of the cell's first link (``'link_text'``),
+        and the hrefs of all the links in the cell (``'hrefs'``).
+
+        If the page links to a next page of alerts, with a link whose rel is
+        "next" or whose text starts with "Next", the link's href is saved in
+        :attr:`next_href`.
+        """
+        def __init__(self):
+            HTMLParser.__init__(self)
+            self.rows = []
+            self.next_href = None
+            self._cells = None
+            self._cell = None
+            self._text_key = None
+            # href and text of the link being read outside of any alert row
+            self._link = None
+
+        def pop_rows(self):
+            rows, self.rows = self.rows, []
+            return rows
+
+        def _end_row(self):
+            if self._cells is not None:
+                self.rows.append(self._cells)
+            self._cells = self._cell = None
+
+        def handle_starttag(self, tag, attrs):
+            self._text_key = None
+            if tag == 'tr':
+                self._end_row()
+                if dict(attrs).get('class') == 'ACTIVE':
+                    self._cells = []
+            elif self._cells is None:
+                if tag in ('a', 'link') and self.next_href is None:
+                    attrs = dict(attrs)
+                    if 'next' in (attrs.get('rel') or '').lower().split():
+                        self.next_href = attrs.get('href')
+                    elif tag == 'a' and attrs.get('href'):
+                        self._link = [attrs['href'], u'']
+            elif tag == 'td':
+                self._cell = {'input': None, 'text': None, 'link_text': None,
+                    'hrefs': []}
+                self._cells.append(self._cell)
+                self._text_key = 'text'
+            elif self._cell is None:
+                return
+            elif tag == 'input':
+                if self._cell['input'] is None:
+                    self._cell['input'] = dict(attrs).get('value')
+            elif tag == 'a':
+                self._cell['hrefs'].append(dict(attrs).get('href'))
+                if len(self._cell['hrefs']) == 1:
+                    self._text_key = 'link_text'
+
+        def handle_endtag(self, tag):
+            self._text_key = None
+            if tag in ('tr', 'table'):
+                self._end_row()
+            elif tag == 'a' and self._link is not None:
+                href, text = self._link
+                self._link = None
+                if text.strip().lower().startswith('next'):
+                    self.next_href = href
+
+        def handle_data(self, data):
+            if self._link is not None:
+                self._link[1] += data
+            if self._text_key is not None:
+                self._cell[self._text_key] = \
+                    (self._cell[self._text_key] or u'') + data
+
+        def handle_entityref(self, name):
+            if name in name2codepoint:
+                self.handle_data(unichr(name2codepoint[name]))
+            else:
+                self.handle_data(u'&%s;' % name)
+
+        def handle_charref(self, name):
+            try:
+                if name[:1] in 'xX':
+                    self.handle_data(unichr(int(name[1:], 16)))
+                else:
+                    self.handle_data(unichr(int(name)))
+            except ValueError:
+                self.handle_data(u'&#%s;' % name)
+
+        def close(self):
+            HTMLParser.close(self)
+            self._end_row()
+    return _AlertsParser
+
+
+class RequestEvent(object):
+    """
+    Describes one request made by a :class:`GAlertsManager`, and is passed to
+    each of its :attr:`GAlertsManager.hooks` once the response has been
+    closed, or once the request has failed.
+
+    :attr:`op` names the operation the request was made for, e.g.
+    ``'list'``, ``'create'``, or ``'scrape sig'``. Durations are in
+    seconds: :attr:`connect` is the time spent opening connections (zero if
+    a keep-alive connection was reused), :attr:`wait` the time from sending
+    the request until the response headers arrived, :attr:`read` the time
+    spent reading the body, and :attr:`parse` the time spent parsing it.
+    :attr:`elapsed` is the time from the start of the request until the
+    response was closed. When the request was redirected, :attr:`requests`
+    counts every request sent and :attr:`connect` and :attr:`wait` cover all
+    of them. :attr:`error` is the exception raised if the request failed
+    before a response arrived, otherwise ``None``. :attr:`attempt` is 0 for
+    the first attempt at a request and counts up for each retry.
+    """
+    __slots__ = ('op', 'method', 'url', 'attempt', 'status', 'bytes',
+        'requests', 'connect', 'wait', 'read', 'parse', 'elapsed', 'error')
+
+    def __init__(self, op, method, url, attempt=0):
+        self.op = op
+        self.method = method
+        self.url = url
+        self.attempt = attempt
+        self.status = self.error = None
+        self.bytes = self.requests = 0
+        self.connect = self.wait = self.read = self.parse = self.elapsed = 0.0
+
+    def __repr__(self):
+        return '<%s %s %s %s %s>' % (self.__class__.__name__, self.op,
+            self.method, self.url, self.status)
+
+
+class RequestStats(object):
+    """
+    Aggregates :class:`RequestEvent` objects into counts, byte totals, and
+    latency histograms per operation. Instances are callable, so one can be
+    added to the *hooks* of any number of managers. Thread-safe.
+
+    Each histogram is a list of counts, one for each upper bound in
+    :attr:`BUCKETS` plus one for slower events.
+    """
+
+    #: Upper bounds of the histogram buckets, in seconds.
+    BUCKETS = (.001, .002, .005, .01, .02, .05, .1, .2, .5, 1, 2, 5, 10, 30)
+
+    #: The durations of a :class:`RequestEvent` histograms are kept for.
+    PHASES = ('connect', 'wait', 'read', 'parse', 'elapsed')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets all the events seen so far.
+        """
+        with self._lock:
+            #: number of events per operation
+            self.counts = Counter()
+            #: number of failed requests per operation
+            self.errors = Counter()
+            #: number of responses per ``(op, status)``
+            self.statuses = Counter()
+            #: bytes read per operation
+            self.bytes = Counter()
+            #: total seconds per ``(op, phase)``
+            self.totals = Counter()
+            #: histogram per ``(op, phase)``
+            self.histograms = {}
+
+    def __call__(self, event):
+        op = event.op
+        with self._lock:
+            self.counts[op] += 1
+            if event.error is not None:
+                self.errors[op] += 1
+            else:
+                self.statuses[op, event.status] += 1
+            self.bytes[op] += event.bytes
+            for phase in self.PHASES:
+                seconds = getattr(event, phase)
+                self.totals[op, phase] += seconds
+                histogram = self.histograms.get((op, phase))
+                if histogram is None:
+                    histogram = self.histograms[op, phase] = \
+                        [0] * (len(self.BUCKETS) + 1)
+                histogram[bisect_left(self.BUCKETS, seconds)] += 1
+
+    def percentile(self, op, phase, p):
+        """
+        Returns the upper bound of the histogram bucket holding the *p*\ th
+        percentile of *phase* for *op*, ``None`` if there were no events, or
+        ``float('inf')`` if it's beyond the last bucket.
+        """
+        with self._lock:
+            histogram = self.histograms.get((op, phase))
+            if histogram is None:
+                return None
+            rank = p / 100.0 * sum(histogram)
+            seen = 0
+            for bound, count in zip(self.BUCKETS + (float('inf'),),
+                    histogram):
+                seen += count
+                if count and seen >= rank:
+                    return bound
+
+    def summary(self):
+        """
+        Returns a dict mapping each operation to a dict of its count, errors,
+        bytes, and the mean, median, and 95th percentile of each phase, for
+        reporting or exporting.
+        """
+        with self._lock:
+            ops = list(self.counts)
+        summary = {}
+        for op in ops:
+            with self._lock:
+                count = self.counts[op]
+                stats = {
+                    'count': count,
+                    'errors': self.errors[op],
+                    'bytes': self.bytes[op],
+                    }
+                for phase in self.PHASES:
+                    stats[phase + '_mean'] = self.totals[op, phase] / count
+            for phase in self.PHASES:
+                stats[phase + '_p50'] = self.percentile(op, phase, 50)
+                stats[phase + '_p95'] = self.percentile(op, phase, 95)
+            summary[op] = stats
+        return summary
+
+
+class _InstrumentedResponse(object):
+    """
+    Wraps a response to time reads of its body and count its bytes, passing
+    *event* to *emit* once the response is closed.
+    """
+    def __init__(self, response, event, start, emit):
+        self._response = response
+        self.event = event
+        self._start = start
+        self._emit = emit
+
+    def read(self, amt=-1):
+        start = time.time()
+        data = self._response.read(amt)
+        self.event.read += time.time() - start
+        self.event.bytes += len(data)
+        return data
+
+    def close(self):
+        self._response.close()
+        emit, self._emit = self._emit, None
+        if emit is not None:
+            self.event.elapsed = time.time() - self._start
+            emit(self.event)
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+
+class _ConnectionPool(object):
+    """
+    Holds idle keep-alive connections for reuse, at most *maxsize* per host.
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns an idle connection for *key*, or ``None``. Connections the
+        server has closed while they were idle are discarded.
+        """
+        while True:
+            with self._lock:
+                conns = self._idle.get(key)
+                conn = conns.pop() if conns else None
+            if conn is None or not self._dropped(conn):
+                return conn
+            conn.close()
+
+    @staticmethod
+    def _dropped(conn):
+        # an idle connection only becomes readable when the server closes it
+        import select
+        if conn.sock is None:
+            return True
+        try:
+            return bool(select.select([conn.sock], [], [], 0)[0])
+        except (select.error, ValueError):
+            return True
+
+    def put(self, key, conn):
+        with self._lock:
+            conns = self._idle.setdefault(key, [])
+            if len(conns) < self.maxsize:
+                conns.append(conn)
+                return
+        conn.close()
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.itervalues():
+            for conn in conns:
+                conn.close()
+
+
+class _PooledReader(object):
+    """
+    Reads a response body off a pooled connection, returning the connection
+    to the pool once the body has been read completely. A connection whose
+    response is closed before then is discarded, since the rest of the body
+    would still be waiting on the socket.
+    """
+    def __init__(self, pool, key, conn, response):
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._response = response
+
+    def recv(self, amt):
+        data = self._response.read(amt)
+        if not data or self._response.isclosed():
+            self._release()
+        return data
+
+    def _release(self):
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        if self._response.will_close:
+            conn.close()
+        else:
+            self._pool.put(self._key, conn)
+
+    def close(self):
+        if self._conn is not None and not self._response.isclosed():
+            self._conn.close()
+            self._conn = None
+        self._release()
+        self._response.close()
+
+
+class _DecompressingReader(object):
+    """
+    Decompresses a response body with the given Content-Encoding, gzip or
+    deflate, as it's read from *reader*.
+    """
+    def __init__(self, reader, encoding):
+        self._reader = reader
+        self._encoding = encoding
+        self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS
+            if encoding == 'gzip' else zlib.MAX_WBITS)
+        self._started = False
+        self._buffer = ''
+
+    def recv(self, amt):
+        while not self._buffer and self._decompressor is not None:
+            data = self._reader.recv(amt)
+            if data:
+                self._buffer = self._decompress(data)
+            else:
+                self._buffer = self._decompressor.flush()
+                self._decompressor = None
+        data, self._buffer = self._buffer[:amt], self._buffer[amt:]
+        return data
+
+    def _decompress(self, data):
+        try:
+            data = self._decompressor.decompress(data)
+        except zlib.error:
+            if self._started or self._encoding != 'deflate':
+                raise
+            # some servers send raw deflate data, without the zlib header
+            self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            data = self._decompressor.decompress(data)
+        self._started = True
+        return data
+
+    def close(self):
+        self._reader.close()
+
+
+class _KeepAliveMixin(object):
+    """
+    Replaces urllib2's one-connection-per-request behavior with persistent
+    HTTP/1.1 connections drawn from a :class:`_ConnectionPool`. Responses
+    are requested compressed, and decompressed as they're read.
+
+    While *events* (a :class:`threading.local`) has a :class:`RequestEvent`
+    as its ``current`` attribute, the requests made from that thread are
+    timed and counted in it.
+
+    A request that fails on a pooled connection the server has closed is
+    sent again on a new connection, unless it is a ``POST`` that may
+    already have reached the server.
+    """
+    def __init__(self, pool, events):
+        self._pool = pool
+        self._events = events
+
+    def _keepalive_open(self, conn_class, req):
+        host = req.get_host()
+        if not host:
+            raise urllib2.URLError('no host given')
+        # behind an https proxy, *host* is the proxy, which connections
+        # tunnel through to the real host
+        tunnel_host = getattr(req, '_tunnel_host', None)
+        key = (conn_class, host, tunnel_host)
+        headers = dict(req.unredirected_hdrs)
+        headers.update((k, v) for k, v in req.headers.items()
+            if k not in headers)
+        headers = dict((k.title(), v) for k, v in headers.items())
+        headers.setdefault('Accept-Encoding', 'gzip, deflate')
+        tunnel_headers = {}
+        if tunnel_host and 'Proxy-Authorization' in headers:
+            # for the proxy only, not the real host
+            tunnel_headers['Proxy-Authorization'] = \
+                headers.pop('Proxy-Authorization')
+        event = getattr(self._events, 'current', None)
+        conn = self._pool.get(key)
+        if conn is not None:
+            try:
+                response = self._send(conn, req, headers, event)
+            except (socket.error, httplib.HTTPException), e:
+                conn.close()
+                conn = None
+                if getattr(e, 'sent', False) and \
+                        req.get_method() not in ('GET', 'HEAD'):
+                    # the server may have acted on the request before the
+                    # connection failed, so it mustn't be sent again
+                    raise urllib2.URLError(e)
+                # the server closed the idle connection; use a new one
+        if conn is None:
+            conn = conn_class(host, timeout=req.timeout)
+            if tunnel_host:
+                conn.set_tunnel(tunnel_host, headers=tunnel_headers)
+            try:
+                if event is not None:
+                    start = time.time()
+                    conn.connect()
+                    event.connect += time.time() - start
+                response = self._send(conn, req, headers, event)
+            except (socket.error, httplib.HTTPException), e:
+                conn.close()
+                raise urllib2.URLError(e)
+        reader = _PooledReader(self._pool, key, conn, response)
+        encoding = (response.getheader('Content-Encoding') or '').lower()
+        if encoding in ('gzip', 'deflate'):
+            reader = _DecompressingReader(reader, encoding)
+            # describe the body as it will be read
+            del response.msg['Content-Encoding']
+            del response.msg['Content-Length']
+        fp = socket._fileobject(reader, close=True)
+        resp = urllib.addinfourl(fp, response.msg, req.get_full_url())
+        resp.code = response.status
+        resp.msg = response.reason
+        return resp
+
+    def _send(self, conn, req, headers, event=None):
+        """
+        Sends *req* on *conn* and returns the response. If the request was
+        sent but no response was read, the exception raised has a true
+        ``sent`` attribute.
+        """
+        if event is not None:
+            event.requests += 1
+            start = time.time()
+        try:
+            conn.request(req.get_method(), req.get_selector(), req.data,
+                headers)
+            try:
+                return conn.getresponse()
+            except (socket.error, httplib.HTTPException), e:
+                e.sent = True
+                raise
+        finally:
+            if event is not None:
+                event.wait += time.time() - start
+
+
+@_LazyClass
+def _KeepAliveHTTPHandler():
+    class _KeepAliveHTTPHandler(_KeepAliveMixin, urllib2.HTTPHandler):
+        def http_open(self, req):
+            return self._keepalive_open(httplib.HTTPConnection, req)
+    return _KeepAliveHTTPHandler
+
+
+@_LazyClass
+def _KeepAliveHTTPSHandler():
+    class _KeepAliveHTTPSHandler(_KeepAliveMixin, urllib2.HTTPSHandler):
+        def __init__(self, pool, events):
+            urllib2.HTTPSHandler.__init__(self)
+            _KeepAliveMixin.__init__(self, pool, events)
+
+        def https_open(self, req):
+            return self._keepalive_open(httplib.HTTPSConnection, req)
+    return _KeepAliveHTTPSHandler
+
+
+@_LazyClass
+def _RedirectHandler():
+    class _RedirectHandler(urllib2.HTTPRedirectHandler):
+        """
+        Follows redirects, except for requests with a false
+        ``follow_redirects`` attribute, whose redirect responses are raised
+        as ``HTTPError`` instead.
+        """
+        def redirect_request(self, req, fp, code, msg, headers, newurl):
+            if not getattr(req, 'follow_redirects', True):
+                return None
+            return urllib2.HTTPRedirectHandler.redirect_request(self, req, fp,
+                code, msg, headers, newurl)
+    return _RedirectHandler
+
+
 class GAlertsManager(object):
     """
     Manages creation, modification, and deletion of Google Alerts for the
@@ -275,35 +1254,194 @@ class GAlertsManager(object):
     instantiated with when creating new email alerts or changing feed alerts
     to email alerts.
     """
-    def __init__(self, email, password):
+
+    #: Default number of seconds a listing of :attr:`alerts` is reused before
+    #: Google is queried again.
+    CACHE_TTL = 60
+
+    #: Default maximum number of requests the batch methods have in flight
+    #: at once.
+    CONCURRENCY = 4
+
+    #: Number of bytes of a page read and parsed at a time.
+    CHUNK_SIZE = 16384
+
+    #: Default base url of the Google Accounts service used to sign in.
+    ACCOUNTS_URL = 'https://accounts.google.com'
+
+    #: Default base url of the Google Alerts web interface.
+    ALERTS_URL = 'http://www.google.com'
+
+    #: Default policy for retrying requests that fail.
+    RETRY_POLICY = RetryPolicy()
+
+    def __init__(self, email, password, cache_ttl=CACHE_TTL,
+            concurrency=CONCURRENCY, session_file=None,
+            accounts_url=ACCOUNTS_URL, alerts_url=ALERTS_URL, hooks=None,
+            retry_policy=RETRY_POLICY, circuit_breaker=None,
+            rate_limiters=()):
         """
         :param email: sign in using this email address. If there is no @
             symbol in the value, "@gmail.com" will be appended.
         :param password: plaintext password, used only to get a session
-            cookie. Sent over a secure connection and then discarded.
+            cookie. Sent over a secure connection and then discarded. May be
+            ``None`` if *session_file* holds a session that is still valid.
+        :param cache_ttl: number of seconds a listing of :attr:`alerts` is
+            cached before Google is queried again. Pass 0 to query Google
+            on every access.
+        :param concurrency: the maximum number of requests the batch methods
+            (:meth:`create_many` etc.) send in parallel, which is also the
+            maximum number of keep-alive connections kept open per host.
+            Pass 1 to send requests one at a time.
+        :param session_file: path of a file to save the session cookies to
+            (in Mozilla ``cookies.txt`` format) after signing in. If the file
+            holds a session that is still valid, it is used instead of
+            signing in again. Processes sharing the file take turns using it,
+            so only one of them signs in when the session has expired.
+        :param accounts_url: base url of the service to sign in with
+        :param alerts_url: base url of the Google Alerts web interface.
+            Together with *accounts_url*, this lets you point the manager at
+            a stand-in for Google, such as ``bench/mockserver.py``.
+        :param hooks: callables to pass a :class:`RequestEvent` describing
+            each request this manager makes, e.g. a :class:`RequestStats`.
+            Hooks can also be added to :attr:`hooks` later. They're called
+            from the thread that made the request, so should be quick. With
+            no hooks, requests aren't timed at all.
+        :param retry_policy: a :class:`RetryPolicy` deciding which failed
+            requests are retried, or ``None`` to never retry
+        :param circuit_breaker: a :class:`CircuitBreaker` counting this
+            manager's failed requests. Defaults to a new one with the default
+            settings; pass ``CircuitBreaker(threshold=0)`` to never refuse
+            requests.
+        :param rate_limiters: :class:`TokenBucket` objects limiting the rate
+            of this manager's requests, including retries. Every request
+            waits for each of them in turn. A bucket can limit a single
+            manager, be shared by many managers to set a global limit, or be
+            a :class:`FileTokenBucket` to share a limit across processes.
 
         :raises SignInError: if Google responds with "403 Forbidden" to
-            our request to sign in
+            our request to sign in, or if no password was given and there is
+            no valid session to resume
         :raises UnexpectedResponseError: if the status code of Google's
               response is unrecognized (neither 403 nor 200)
         :raises socket.error: e.g. if there is no network connection
+
+        Any method that makes requests may raise :class:`CircuitOpenError`
+        while the circuit breaker is refusing requests.
         """
         if '@' not in email:
             email += '@gmail.com'
         self.email = email
-        self.opener = urllib2.build_opener(urllib2.HTTPCookieProcessor())
-        urllib2.install_opener(self.opener)
-        self._signin(password)
+        self.accounts_url = accounts_url
+        self.alerts_url = alerts_url
+        self.cache_ttl = cache_ttl
+        self._cache = None
+        self._cache_time = 0
+        self._cache_version = 0
+        # url -> (validators, alerts, next url) of each manage page listed,
+        # so an unchanged page needn't be downloaded or parsed again
+        self._pages = {}
+        # url -> (validators, values) of each page scraped for inputs
+        self._scraped = {}
+        self._sig = None
+        self.concurrency = concurrency
+        self._lock = threading.RLock()
+        self._workers = None
+        self._connections = _ConnectionPool(concurrency)
+        self.hooks = list(hooks or ())
+        self._events = threading.local()
+        self.retry_policy = retry_policy
+        if circuit_breaker is None:
+            circuit_breaker = CircuitBreaker()
+        self.circuit_breaker = circuit_breaker
+        self.rate_limiters = list(rate_limiters)
+        self.session_file = session_file
+        if session_file is None:
+            self.cookies = cookielib.CookieJar()
+        else:
+            self.cookies = cookielib.MozillaCookieJar(session_file)
+        # each manager has its own opener and cookie jar (which is safe to
+        # share between threads), so any number of managers can be used
+        # side by side
+        self.opener = urllib2.build_opener(
+            urllib2.HTTPCookieProcessor(self.cookies),
+            _RedirectHandler(),
+            _KeepAliveHTTPHandler(self._connections, self._events),
+            _KeepAliveHTTPSHandler(self._connections, self._events),
+            )
+        if session_file is None:
+            self._signin(password)
+            return
+        with _FileLock(session_file + '.lock'):
+            if not self._resume_session():
+                self._signin(password)
+                self._save_session()
+
+    def close(self):
+        """
+        Stops the worker threads used by the batch methods and closes idle
+        connections. The manager can still be used afterwards.
+        """
+        with self._lock:
+            workers, self._workers = self._workers, None
+        if workers is not None:
+            workers.close()
+        self._connections.clear()
+        if self.session_file is not None:
+            # Google may have refreshed the session cookies since sign in
+            with _FileLock(self.session_file + '.lock'):
+                self._save_session()
+
+    def _resume_session(self):
+        """
+        Loads the session saved in :attr:`session_file`, if any, and returns
+        whether it is still valid.
+
+        Expired cookies are dropped on loading, so a session with none left is
+        known to be invalid without asking Google. Otherwise the session is
+        checked by requesting the manage page, which Google redirects to the
+        sign in page for invalid sessions; only the start of the page is read.
+        """
+        try:
+            self.cookies.load(ignore_discard=True)
+        except (IOError, cookielib.LoadError):
+            return False
+        if not len(self.cookies):
+            return False
+        alerts_url = self.alerts_url + '/alerts/manage?hl=en&gl=us'
+        response = self._request(alerts_url, op='resume session')
+        valid = response.getcode() == 200 and \
+            response.geturl().startswith(self.alerts_url + '/alerts/manage')
+        self._discard(response)
+        if not valid:
+            self.cookies.clear()
+        return valid
+
+    def _save_session(self):
+        # the cookies are as good as the password, so they're written to a
+        # new file that only the owner can read, which is then moved into
+        # place; called with the session file's lock held
+        tmp = self.session_file + '.tmp'
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        os.close(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0600))
+        self.cookies.save(tmp, ignore_discard=True)
+        os.rename(tmp, self.session_file)
 
     def _signin(self, password):
         """
         Obtains a cookie from Google for an authenticated session.
         """
-        login_page_url = 'https://accounts.google.com/ServiceLogin'
-        authenticate_url = 'https://accounts.google.com/ServiceLoginAuth'
+        if password is None:
+            raise SignInError('No valid session to resume and no password')
+        login_page_url = self.accounts_url + '/ServiceLogin'
+        authenticate_url = self.accounts_url + '/ServiceLoginAuth'
 
         # Load login page
-        login_page_contents = self.opener.open(login_page_url).read()
+        login_page_contents = self._read(self._request(login_page_url,
+            op='login page'))
 
         # Find GALX value
         galx_match_obj = re.search(
@@ -314,19 +1452,19 @@ class GAlertsManager(object):
         galx_value = galx_match_obj.group(1) \
             if galx_match_obj.group(1) is not None else ''
 
-        params = urlencode({
+        params = urllib.urlencode({
             'Email': self.email,
             'Passwd': password,
             'service': 'alerts',
-            'continue': 'http://www.google.com/alerts/manage?hl=en&gl=us',
+            'continue': self.alerts_url + '/alerts/manage?hl=en&gl=us',
             'GALX': galx_value,
             })
-        response = self.opener.open(authenticate_url, params)
+        response = self._request(authenticate_url, params, op='sign in')
         resp_code = response.getcode()
         final_url = response.geturl()
-        body = response.read()
 
         if resp_code == 403 or final_url == authenticate_url:
+            self._discard(response)
             raise SignInError(
                 'Got 403 Forbidden; bad email/password combination?'
                 )
@@ -335,28 +1473,20 @@ class GAlertsManager(object):
             raise UnexpectedResponseError(
                 resp_code,
                 response.info().headers,
-                body,
+                self._read(response),
                 )
 
+        # we end up on the manage page, which may be huge
+        self._discard(response)
+
     def _scrape_sig(self, path='/alerts'):
         """
         Google signs forms with a value in a hidden input named "x" to
         prevent xss attacks, so we need to scrape this out and submit it along
         with any forms we POST.
         """
-        url = 'http://www.google.com%s' % path
-        response = self.opener.open(url)
-        resp_code = response.getcode()
-        body = response.read()
-        if resp_code != 200:
-            raise UnexpectedResponseError(
-                resp_code,
-                response.info().headers,
-                body,
-                )
-        soup = BeautifulSoup(body)
-        sig = soup.findChild('input', attrs={'name': 'x'})['value']
-        return str(sig)
+        url = self.alerts_url + path
+        return self._scrape_inputs(url, ('x',), 'scrape sig')[0]
 
     def _scrape_sig_es_hps(self, alert):
         """
@@ -364,73 +1494,295 @@ class GAlertsManager(object):
         and "hps" which must be scraped and passed along when modifying it
         along with the "x" hidden input value to prevent xss attacks.
         """
-        url = 'http://www.google.com/alerts/edit?hl=en&gl=us&s=%s' % alert._s
-        response = self.opener.open(url)
-        resp_code = response.getcode()
-        body = response.read()
-        if resp_code != 200:
-            raise UnexpectedResponseError(
-                resp_code,
-                response.info().headers,
-                body,
-                )
-        soup = BeautifulSoup(body)
-        sig = soup.findChild('input', attrs={'name': 'x'})['value']
-        es = soup.findChild('input', attrs={'name': 'es'})['value']
-        hps = soup.findChild('input', attrs={'name': 'hps'})['value']
-        return tuple(str(i) for i in (sig, es, hps))
+        return self._scrape_inputs(self._edit_url(alert), ('x', 'es', 'hps'),
+            'scrape edit page')
+
+    def _edit_url(self, alert):
+        return self.alerts_url + '/alerts/edit?hl=en&gl=us&s=%s' % alert._s
+
+    def _scrape_inputs(self, url, names, op='scrape'):
+        """
+        Returns a tuple of the values of the first inputs named *names* on
+        the page at *url*, requested for operation *op*.
+
+        Rather than parsing the whole page, the response is scanned for
+        ``<input>`` tags a chunk at a time, and the rest of it is skipped as
+        soon as all the values have been found. Only if the page ends without
+        them is it parsed with BeautifulSoup.
+
+        The request is conditional on the page having changed since it was
+        last scraped, if Google gave it an ETag or Last-Modified date, so
+        the values can be reused without downloading the page again.
+        """
+        scraped = self._scraped.get(url)
+        response = self._open(url, op=op,
+            headers=_conditional_headers(scraped and scraped[0]))
+        if response.getcode() == 304:
+            self._discard(response)
+            return scraped[1]
+        event = getattr(response, 'event', None)
+        found = {}
+        read = []
+        pending = ''
+        while len(found) < len(names):
+            chunk = response.read(self.CHUNK_SIZE)
+            if not chunk:
+                break
+            if event is not None:
+                parse_start = time.time()
+            read.append(chunk)
+            pending += chunk
+            end = 0
+            for match in _INPUT_RE.finditer(pending):
+                end = match.end()
+                attrs = dict((k.lower(), v1 or v2 or v3) for (k, v1, v2, v3)
+                    in _ATTR_RE.findall(match.group()))
+                name = attrs.get('name')
+                if name in names and name not in found and 'value' in attrs:
+                    found[name] = str(_unescape(attrs['value']))
+            # keep a tag that may be cut off at the end of the chunk
+            start = pending.rfind('<', end)
+            pending = pending[start:] if start != -1 else ''
+            if event is not None:
+                event.parse += time.time() - parse_start
+        if len(found) == len(names):
+            self._discard(response)
+            return self._scraped_values(url, response,
+                tuple(found[name] for name in names))
+
+        body = ''.join(read) + response.read()
+        from BeautifulSoup import BeautifulSoup
+        try:
+            if event is not None:
+                parse_start = time.time()
+            soup = BeautifulSoup(body)
+            if event is not None:
+                event.parse += time.time() - parse_start
+            values = []
+            for name in names:
+                tag = soup.findChild('input', attrs={'name': name})
+                if tag is None or tag.get('value') is None:
+                    raise UnexpectedResponseError(200,
+                        response.info().headers, body)
+                values.append(str(tag['value']))
+            return self._scraped_values(url, response, tuple(values))
+        finally:
+            response.close()
+
+    def _scraped_values(self, url, response, values):
+        """
+        Remembers the *values* scraped from the page at *url* along with the
+        validators of the *response* it came in, and returns them.
+        """
+        validators = _validators(response)
+        if validators is not None:
+            self._scraped[url] = (validators, values)
+        return values
+
+    def _discard(self, response):
+        """
+        Closes *response*, first reading what remains of it if that's short
+        enough to be worth keeping the connection for.
+        """
+        remaining = 4 * self.CHUNK_SIZE
+        while remaining > 0:
+            chunk = response.read(self.CHUNK_SIZE)
+            if not chunk:
+                break
+            remaining -= len(chunk)
+        response.close()
 
     @property
     def alerts(self):
         """
-        Queries Google on every access for the alerts associated with this
-        account, wraps them in :class:`Alert` objects, and returns a generator
-        you can use to iterate over them.
+        Returns a generator you can use to iterate over the alerts associated
+        with this account, wrapped in :class:`Alert` objects.
+
+        Google is only queried if the alerts have not been fetched within the
+        last :attr:`cache_ttl` seconds. :meth:`update` and :meth:`delete`
+        keep the cached alerts up to date and :meth:`create` discards them,
+        so you only need to call :meth:`invalidate_cache` if the alerts were
+        modified elsewhere, e.g. through the web interface. Each access
+        yields fresh copies, so modifying the yielded objects does not affect
+        the cache.
+
+        When Google is queried, each alert is yielded as soon as it has been
+        read from the response, and any further pages of alerts are only
+        requested once the alerts on the previous page have been consumed.
+        If you stop iterating early, the rest of the alerts are never
+        downloaded. With a :attr:`cache_ttl` of 0, the alerts aren't kept
+        either, so even the largest accounts can be listed in constant
+        memory.
         """
-        alerts_url = 'http://www.google.com/alerts/manage?hl=en&gl=us'
-        response = self.opener.open(alerts_url)
-        resp_code = response.getcode()
-        body = response.read()
-        if resp_code != 200:
-            raise UnexpectedResponseError(resp_code, [], body)
-
-        soup = BeautifulSoup(body, convertEntities=BeautifulSoup.HTML_ENTITIES)
-        trs = soup.findAll('tr', attrs={'class': 'ACTIVE'})
-        for tr in trs:
-            tds = tr.findAll('td')
-            # annoyingly, if you have no alerts, Google tells you this in
-            # a <tr> with class "data_row" in a single <td>
-            if len(tds) < 6:
-                # we continue rather than break because there could be
-                # subsequent iterations for other email addresses associated
-                # with this account which do have alerts
+        with self._lock:
+            cache = self._cache._values() if self._cache_fresh() else None
+            version = self._cache_version
+        if cache is not None:
+            for alert in cache:
+                yield alert._copy()
+            return
+        alerts = self._fetch_alerts()
+        if self.cache_ttl <= 0:
+            try:
+                for alert in alerts:
+                    yield alert
+            finally:
+                alerts.close()
+            return
+        fetched = []
+        try:
+            for alert in alerts:
+                fetched.append(alert)
+                yield alert._copy()
+        finally:
+            alerts.close()
+        with self._lock:
+            # don't clobber changes made to the cache while we were fetching
+            if self._cache_version == version:
+                self._cache = AlertIndex._owning(fetched)
+                self._cache_time = time.time()
+                self._cache_version += 1
+
+    def invalidate_cache(self):
+        """
+        Discards the cached alerts so the next access of :attr:`alerts`
+        queries Google.
+        """
+        with self._lock:
+            self._cache = None
+            self._cache_version += 1
+
+    def _cache_fresh(self):
+        return self._cache is not None and \
+            time.time() - self._cache_time < self.cache_ttl
+
+    @property
+    def index(self):
+        """
+        An :class:`AlertIndex` of the alerts associated with this account,
+        for looking them up by id, query, or feed url in constant time.
+
+        This is the index the alerts are cached in, so it's only rebuilt by
+        querying Google once the alerts have been cached for longer than
+        :attr:`cache_ttl` seconds (or the cache has been invalidated, as
+        :meth:`create` does), and :meth:`update` and :meth:`delete` keep it
+        up to date as they go. Access this property for each lookup rather
+        than holding onto an index, which goes stale once the cache expires.
+        With a :attr:`cache_ttl` of 0, every access builds a new index from
+        a fresh listing.
+        """
+        with self._lock:
+            if self._cache_fresh():
+                return self._cache
+        fetched = list(self.alerts)
+        with self._lock:
+            if self._cache_fresh():
+                return self._cache
+        return AlertIndex._owning(fetched)
+
+    def _fetch_alerts(self):
+        """
+        Yields the alerts on the manage page, followed by those on each
+        further page it links to, one page at a time.
+
+        Unless alerts aren't cached at all (:attr:`cache_ttl` is 0), the
+        alerts on each page that's read to the end are kept along with the
+        page's validators, and the page is requested again only if it has
+        changed; if Google answers "304 Not Modified", the alerts are
+        yielded from the last time instead.
+        """
+        url = self.alerts_url + '/alerts/manage?hl=en&gl=us'
+        pages = self._pages if self.cache_ttl > 0 else None
+        seen = set()
+        while url is not None and url not in seen:
+            seen.add(url)
+            page = pages.get(url) if pages is not None else None
+            response = self._open(url, op='list',
+                headers=_conditional_headers(page and page[0]))
+            if response.getcode() == 304:
+                self._discard(response)
+                for alert in page[1]:
+                    yield alert._copy()
+                url = page[2]
                 continue
-            tdcheckbox = tds[0]
-            tdquery = tds[1]
-            tdvol = tds[2]
-            tdfreq = tds[3]
-            tddeliver = tds[4]
-            tdtype = tds[5]
-
-            s = tdcheckbox.findChild('input')['value']
-            s = str(s)
-            query = tdquery.findChild('a').next
-            query = unicode(query)
-            freq = tdfreq.next
-            freq = str(freq)
-            vol = tdvol.next
-            vol = str(vol)
-
-            if not tddeliver.findAll('a'):
-                feedurl = None
-                deliver = DELIVER_EMAIL # normalize
-            else: # deliver is an anchor tag
-                feedurl = tddeliver.findAll('a')[1]['href']
-                feedurl = str(feedurl)
-                deliver = DELIVER_FEED
-            email = self.email # scrape out of html if and when we support accounts with multiple addresses
+            parser = _AlertsParser()
+            alerts = self._parse_alerts(response, parser)
+            kept = []
+            try:
+                for alert in alerts:
+                    if pages is not None:
+                        kept.append(alert)
+                    yield alert
+            finally:
+                alerts.close()
+            next_url = parser.next_href and \
+                urlparse.urljoin(response.geturl(), parser.next_href)
+            validators = _validators(response)
+            if pages is not None and validators is not None:
+                pages[url] = (validators, kept, next_url)
+            url = next_url
+
+    def _parse_alerts(self, response, parser=None):
+        """
+        Reads the manage page from *response* a chunk at a time and yields
+        an :class:`Alert` for each alert as soon as its row has been read.
+        """
+        charset = response.info().getparam('charset') or 'utf-8'
+        try:
+            decoder = codecs.getincrementaldecoder(charset)('replace')
+        except LookupError:
+            decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        if parser is None:
+            parser = _AlertsParser()
+        event = getattr(response, 'event', None)
+        try:
+            while True:
+                chunk = response.read(self.CHUNK_SIZE)
+                if event is not None:
+                    parse_start = time.time()
+                if chunk:
+                    parser.feed(decoder.decode(chunk))
+                else:
+                    parser.feed(decoder.decode('', True))
+                    parser.close()
+                alerts = [self._row_to_alert(cells)
+                    for cells in parser.pop_rows()]
+                if event is not None:
+                    event.parse += time.time() - parse_start
+                for alert in alerts:
+                    if alert is not None:
+                        yield alert
+                if not chunk:
+                    break
+        finally:
+            response.close()
+
+    def _row_to_alert(self, cells):
+        # annoyingly, if you have no alerts, Google tells you this in
+        # a <tr> with class "data_row" in a single <td>
+        if len(cells) < 6:
+            # we skip rather than stop because there could be subsequent
+            # rows for other email addresses associated with this account
+            # which do have alerts
+            return None
+        tdcheckbox, tdquery, tdvol, tdfreq, tddeliver, tdtype = cells[:6]
+        s = str(tdcheckbox['input'])
+        query = tdquery['link_text'] or u''
+        freq = str(tdfreq['text'])
+        vol = str(tdvol['text'])
+        if not tddeliver['hrefs']:
+            feedurl = None
+            deliver = DELIVER_EMAIL # normalize
+        else: # deliver is an anchor tag
+            feedurl = str(tddeliver['hrefs'][1])
+            deliver = DELIVER_FEED
+        email = self.email # scrape out of html if and when we support accounts with multiple addresses
+        type = tdtype['text'] and tdtype['text'].strip()
+        if type not in ALERT_TYPES:
             type = TYPE_EVERYTHING
-            yield Alert(email, s, query, type, freq, vol, deliver, feedurl=feedurl)
+        else:
+            type = str(type)
+        return Alert(email, s, query, type, freq, vol, deliver, feedurl=feedurl)
 
     def create(self, query, type, feed=True, freq=FREQ_ONCE_A_DAY,
             vol=VOL_ONLY_BEST):
@@ -446,28 +1798,34 @@ class GAlertsManager(object):
         :param vol: a value in :attr:`ALERT_VOLS` indicating volume of results
             to be delivered. Defaults to :attr:`VOL_ONLY_BEST`.
         """
-        url = 'http://www.google.com/alerts/create?hl=en&gl=us'
+        self._create(self._scrape_sig(), query, type, feed=feed, freq=freq,
+            vol=vol)
+
+    def _create(self, sig, query, type, feed=True, freq=FREQ_ONCE_A_DAY,
+            vol=VOL_ONLY_BEST):
+        url = self.alerts_url + '/alerts/create?hl=en&gl=us'
         params = safe_urlencode({
             'q': query,
             'e': DELIVER_FEED if feed else self.email,
             'f': ALERT_FREQS[FREQ_AS_IT_HAPPENS if feed else freq],
             't': ALERT_TYPES[type],
             'l': ALERT_VOLS[vol],
-            'x': self._scrape_sig(),
+            'x': sig,
         })
-        response = self.opener.open(url, params)
-        resp_code = response.getcode()
-        if resp_code != 200:
-            raise UnexpectedResponseError(resp_code,
-                response.info().headers,
-                response.read(),
-                )
+        self._discard(self._open(url, params, op='create',
+            follow_redirects=False))
+        self._cache_created()
 
-    def update(self, alert):
+    def update(self, alert, force=False):
         """
         Updates an existing alert which has been modified.
+
+        Does nothing if none of the alert's properties have been changed
+        (see :attr:`Alert.modified`) unless *force* is true.
         """
-        url = 'http://www.google.com/alerts/save?hl=en&gl=us'
+        if not alert._modified and not force:
+            return
+        url = self.alerts_url + '/alerts/save?hl=en&gl=us'
         sig, es, hps = self._scrape_sig_es_hps(alert)
         params = {
             'd': DELIVER_TYPES.get(alert.deliver, DELIVER_DEFAULT_VAL),
@@ -483,39 +1841,2008 @@ class GAlertsManager(object):
         if alert.deliver == DELIVER_EMAIL:
             params['f'] = ALERT_FREQS[alert.freq]
         params = safe_urlencode(params)
-        response = self.opener.open(url, params)
-        resp_code = response.getcode()
-        if resp_code != 200:
-            raise UnexpectedResponseError(
-                resp_code,
-                response.info().headers,
-                response.read(),
-                )
+        # Google redirects to the manage page, which we needn't download
+        self._discard(self._open(url, params, op='update',
+            follow_redirects=False))
+        alert._modified = 0
+        self._cache_updated(alert)
 
     def delete(self, alert):
         """
         Deletes an existing alert.
         """
-        url = 'http://www.google.com/alerts/save?hl=en&gl=us'
-        params = urlencode({
+        self._delete(self._scrape_sig(path='/alerts/manage?hl=en&gl=us'),
+            alert)
+
+    def _delete(self, sig, alert):
+        url = self.alerts_url + '/alerts/save?hl=en&gl=us'
+        params = urllib.urlencode({
             'da': 'Delete',
             'e': self.email,
             's': alert._s,
-            'x': self._scrape_sig(path='/alerts/manage?hl=en&gl=us'),
+            'x': sig,
         })
-        response = self.opener.open(url, params)
-        resp_code = response.getcode()
-        if resp_code != 200:
-            raise UnexpectedResponseError(
-                resp_code,
-                response.info().headers,
-                response.read(),
-                )
+        self._discard(self._open(url, params, op='delete',
+            follow_redirects=False))
+        self._scraped.pop(self._edit_url(alert), None)
+        self._cache_deleted(alert)
+
+    def create_many(self, items):
+        """
+        Creates many alerts, scraping the signature Google requires only once
+        rather than once per alert. A new signature is scraped only if Google
+        rejects the one in use.
+
+        :param items: an iterable of dicts of keyword arguments for
+            :meth:`create`, e.g. ``{'query': 'galerts', 'type': TYPE_NEWS}``
+
+        Returns a list with an ``(item, error)`` tuple for each item, where
+        *error* is ``None`` if the alert was created or the
+        :class:`UnexpectedResponseError`, :class:`CircuitOpenError`, or
+        network error (``urllib2.URLError``, ``socket.error``, or
+        ``httplib.HTTPException``) raised while creating it. Requests that
+        fail transiently are retried first as the manager's
+        :attr:`retry_policy` allows, so one failure doesn't sink the whole
+        batch.
+
+        Creations aren't retried after a network error, since Google may
+        have created the alert before the connection failed; an item that
+        failed with one may or may not have been created, so list the
+        alerts before creating it again.
+        """
+        return self._many(items, lambda item: self._signed(self._create,
+            **item))
+
+    def update_many(self, alerts):
+        """
+        Updates many alerts, returning a list with an ``(alert, error)`` tuple
+        for each of them as described in :meth:`create_many`. As with
+        :meth:`update`, alerts which haven't been modified are skipped.
+
+        Unlike for :meth:`create_many` and :meth:`delete_many`, the edit page
+        of every alert still has to be scraped, since the hidden values Google
+        requires to save an alert are different for each alert.
+        """
+        return self._many(alerts, self.update)
+
+    def delete_many(self, alerts):
+        """
+        Deletes many alerts, reusing the signature Google requires as
+        described in :meth:`create_many`. Returns a list with an
+        ``(alert, error)`` tuple for each alert.
+        """
+        return self._many(alerts, lambda alert: self._signed(self._delete,
+            alert))
+
+    def sync(self, desired, dry_run=False):
+        """
+        Makes the minimal changes needed for this account's alerts to match
+        *desired*, an iterable of :class:`Alert` objects. (To describe an
+        alert that doesn't exist yet, construct an :class:`Alert` with
+        ``None`` for its *s*.)
+
+        Alerts are matched up by query, type, and delivery method:
+
+        - desired alerts with no match are created
+        - matched alerts whose volume or (for email alerts) frequency differ
+          from the desired ones are updated
+        - existing alerts with no match, including all but the first of
+          several existing alerts that match the same desired alert, are
+          deleted
+
+        The changes are made with :meth:`delete_many`, :meth:`update_many`,
+        and :meth:`create_many`, in that order, so deleting alerts frees up
+        room for new ones. If nothing needs to change, nothing is sent to
+        Google besides, if the alerts are not cached, one request to list
+        them.
+
+        Returns a tuple of lists of the ``(item, error)`` results of the
+        creations, updates, and deletions, as described in
+        :meth:`create_many`.
+
+        :param dry_run: if true, only work out the changes, and return them
+            with ``None`` for every error
+        """
+        wanted = {}
+        for alert in desired:
+            wanted.setdefault(alert._key(), alert)
+        to_update = []
+        to_delete = []
+        matched = set()
+        for alert in self.alerts:
+            key = alert._key()
+            want = wanted.get(key)
+            if want is None or key in matched:
+                to_delete.append(alert)
+                continue
+            matched.add(key)
+            if alert.vol != want.vol or (alert.deliver == DELIVER_EMAIL and
+                    alert.freq != want.freq):
+                alert.vol = want.vol
+                alert.freq = want.freq
+                to_update.append(alert)
+        to_create = [self._create_kwds(want)
+            for (key, want) in wanted.iteritems() if key not in matched]
+        if dry_run:
+            return tuple([(item, None) for item in items]
+                for items in (to_create, to_update, to_delete))
+        deleted = self.delete_many(to_delete) if to_delete else []
+        updated = self.update_many(to_update) if to_update else []
+        created = self.create_many(to_create) if to_create else []
+        return created, updated, deleted
+
+    def export_alerts(self, f, format='jsonl'):
+        """
+        Writes all of this account's alerts to the file *f* as they're
+        listed, as described in :func:`write_alerts`, and returns the number
+        of alerts written.
+        """
+        return write_alerts(self.alerts, f, format)
 
+    def import_alerts(self, f, format='jsonl', checkpoint=None,
+            batch_size=100):
+        """
+        Creates an alert in this account for each alert in the file *f*,
+        e.g. as written by :meth:`export_alerts` for another account. The
+        file is read *batch_size* alerts at a time, and each batch is created
+        concurrently as by :meth:`create_many`. Only the query, type,
+        delivery method (as feed or email to this account), frequency, and
+        volume of the alerts in the file are used.
+
+        Returns a list of ``(alert, error)`` tuples for the alerts in the
+        file, as described in :meth:`create_many`.
+
+        :param format: the format of the file; see :func:`read_alerts`
+        :param checkpoint: path of a file to log the alerts created so far
+            to. If the import is interrupted, calling this again with the
+            same file and checkpoint skips the alerts created already, and
+            only the rest are created (and returned). Alerts that couldn't be
+            created aren't logged, so they're tried again.
+        """
+        done = set()
+        if checkpoint is not None:
+            try:
+                with open(checkpoint, 'r+b') as log:
+                    lines = log.readlines()
+                    if lines and not lines[-1].endswith('\n'):
+                        # cut off while it was being written; drop it, so
+                        # the next number logged doesn't run on from it
+                        del lines[-1]
+                        log.truncate(sum(len(line) for line in lines))
+                done.update(int(line) for line in lines)
+            except IOError:
+                pass
+        log = None if checkpoint is None else open(checkpoint, 'a')
+        log_lock = threading.Lock()
+        def create(item):
+            i, alert = item
+            try:
+                self._signed(self._create, **self._create_kwds(alert))
+            except (UnexpectedResponseError, CircuitOpenError), e:
+                return alert, e, None
+            except Exception:
+                # raised once the rest of the batch is done (and logged), so
+                # nothing is created behind the log's back
+                return alert, None, sys.exc_info()
+            if log is not None:
+                with log_lock:
+                    log.write('%d\n' % i)
+                    log.flush()
+            return alert, None, None
+        pending = ((i, alert) for (i, alert)
+            in enumerate(read_alerts(f, format)) if i not in done)
+        results = []
+        try:
+            while True:
+                batch = list(islice(pending, batch_size))
+                if not batch:
+                    break
+                outcomes = self._map(create, batch)
+                for alert, error, exc_info in outcomes:
+                    if exc_info is not None:
+                        raise exc_info[0], exc_info[1], exc_info[2]
+                    results.append((alert, error))
+        finally:
+            if log is not None:
+                log.close()
+        return results
+
+    @staticmethod
+    def _create_kwds(alert):
+        """
+        Returns the keyword arguments for :meth:`create` that create an
+        alert like *alert*.
+        """
+        return {
+            'query': alert.query,
+            'type': alert.type,
+            'feed': alert.deliver == DELIVER_FEED,
+            'freq': alert.freq,
+            'vol': alert.vol,
+            }
 
-def main():
+    def _many(self, items, func):
+        def call(item):
+            try:
+                func(item)
+                return item, None
+            except (UnexpectedResponseError, CircuitOpenError,
+                    urllib2.URLError, socket.error, httplib.HTTPException), e:
+                return item, e
+        return self._map(call, items)
+
+    def _map(self, func, items):
+        """
+        Like :func:`map`, but calls *func* from up to :attr:`concurrency`
+        worker threads at once.
+        """
+        if self.concurrency <= 1:
+            return map(func, items)
+        with self._lock:
+            if self._workers is None:
+                self._workers = ThreadPool(self.concurrency)
+            workers = self._workers
+        return workers.map(func, items, chunksize=1)
+
+    def _signed(self, func, *args, **kwds):
+        """
+        Calls *func* with the last signature scraped for a batch operation,
+        scraping a new one if there is none yet or if Google rejects it.
+        """
+        sig = self._sig
+        if sig is not None:
+            try:
+                return func(sig, *args, **kwds)
+            except UnexpectedResponseError, e:
+                # only a 4xx means Google refused the request itself (a 429
+                # means too many requests, which a new signature won't fix)
+                if not 400 <= e.resp_status < 500 or e.resp_status == 429:
+                    raise
+        with self._lock:
+            # another thread may have replaced the rejected signature already
+            if self._sig is sig:
+                self._sig = self._scrape_sig(
+                    path='/alerts/manage?hl=en&gl=us')
+            sig = self._sig
+        return func(sig, *args, **kwds)
+
+    def _request(self, url, data=None, op='request', follow_redirects=True,
+            headers=None):
+        """
+        Requests *url*, POSTing *data* if given, for operation *op*, and
+        returns the response, whatever its status. Redirects are followed
+        unless *follow_redirects* is false. *headers* is a dict of extra
+        request headers.
+
+        Requests which fail with a network error or a transient status are
+        retried as :attr:`retry_policy` allows, and are counted by
+        :attr:`circuit_breaker`, as are successful ones. Each attempt first
+        waits until :attr:`rate_limiters` allow it.
+
+        :raises CircuitOpenError: if the circuit breaker is refusing requests
+        """
+        breaker = self.circuit_breaker
+        policy = self.retry_policy
+        attempt = 0
+        while True:
+            # wait before asking the breaker, so a trial request it allows
+            # is always sent and counted
+            for limiter in self.rate_limiters:
+                limiter.acquire()
+            breaker.allow()
+            try:
+                response = self._attempt(url, data, op, attempt,
+                    follow_redirects, headers)
+            except (urllib2.URLError, socket.error, httplib.HTTPException):
+                breaker.failed()
+                if policy is None or attempt >= policy.retries or \
+                        not policy.retryable(op):
+                    raise
+                delay = policy.delay(attempt)
+            except Exception:
+                breaker.failed()
+                raise
+            except BaseException:
+                # e.g. KeyboardInterrupt, which says nothing about Google
+                breaker.abandoned()
+                raise
+            else:
+                status = response.getcode()
+                if status != 429 and status < 500:
+                    breaker.succeeded()
+                    return response
+                breaker.failed()
+                if policy is None or attempt >= policy.retries or \
+                        not policy.retryable(op, status):
+                    return response
+                delay = policy.delay(attempt, _retry_after(response.info()))
+                if delay is None:
+                    return response
+                self._discard(response)
+            time.sleep(delay)
+            attempt += 1
+
+    def _attempt(self, url, data, op, attempt, follow_redirects=True,
+            headers=None):
+        """
+        Makes one attempt at a request for :meth:`_request`.
+
+        If there are any :attr:`hooks`, the attempt is timed and described
+        in a :class:`RequestEvent`, which is passed to the hooks once the
+        response is closed, so callers must close it.
+        """
+        req = urllib2.Request(url, data, headers or {})
+        req.follow_redirects = follow_redirects
+        if not self.hooks:
+            try:
+                return self.opener.open(req)
+            except urllib2.HTTPError, e:
+                return e
+        event = RequestEvent(op, 'GET' if data is None else 'POST', url,
+            attempt)
+        start = time.time()
+        self._events.current = event
+        try:
+            try:
+                response = self.opener.open(req)
+            except urllib2.HTTPError, e:
+                response = e
+        except Exception, e:
+            event.error = e
+            event.elapsed = time.time() - start
+            self._emit(event)
+            raise
+        finally:
+            self._events.current = None
+        event.status = response.getcode()
+        return _InstrumentedResponse(response, event, start, self._emit)
+
+    def _open(self, url, data=None, op='request', follow_redirects=True,
+            headers=None):
+        """
+        Like :meth:`_request`, but returns only successful responses.
+
+        :raises UnexpectedResponseError: if the response status is not 200
+            (or, if *follow_redirects* is false, a redirect, or if *headers*
+            make the request conditional, "304 Not Modified")
+        """
+        response = self._request(url, data, op, follow_redirects, headers)
+        resp_code = response.getcode()
+        if resp_code == 304 and headers and ('If-None-Match' in headers or
+                'If-Modified-Since' in headers):
+            return response
+        if resp_code != 200 and (follow_redirects or
+                not 300 <= resp_code < 400):
+            raise UnexpectedResponseError(
+                resp_code,
+                response.info().headers,
+                self._read(response),
+                )
+        return response
+
+    def _read(self, response):
+        """
+        Reads all of *response* and closes it, returning the body.
+        """
+        try:
+            return response.read()
+        finally:
+            response.close()
+
+    def _emit(self, event):
+        for hook in self.hooks:
+            hook(event)
+
+    def _cache_created(self):
+        """
+        Google assigns new alerts their "s" value and feed url, so a created
+        alert can't be added to the cache from what we sent, and the cache
+        has to be discarded. (Refreshing it from the manage page Google
+        redirects to would cost a whole listing for every alert created.)
+        """
+        self.invalidate_cache()
+
+    def _cache_updated(self, alert):
+        with self._lock:
+            self._cache_version += 1
+            if self._cache is None:
+                return
+            cached = self._cache._get(alert._s)
+            if cached is None:
+                return
+            if cached.deliver != alert.deliver:
+                # Google assigns (or revokes) the feed url and may change the
+                # frequency when the delivery method changes
+                self.invalidate_cache()
+                return
+            updated = alert._copy()
+            updated._feedurl = cached._feedurl
+            if alert.deliver == DELIVER_FEED:
+                # the frequency of feed alerts is not submitted, so it's
+                # unchanged
+                updated._freq = cached._freq
+            self._cache._add(updated)
+
+    def _cache_deleted(self, alert):
+        with self._lock:
+            self._cache_version += 1
+            if self._cache is None:
+                return
+            self._cache.remove(alert._s)
+
+
+class AsyncGAlertsManager(object):
+    """
+    Non-blocking counterpart to :class:`GAlertsManager`.
+
+    galerts supports Python 2, which has no :mod:`asyncio`, so each method
+    instead runs the corresponding blocking call on a pool of worker threads
+    and returns immediately with a :class:`multiprocessing.pool.AsyncResult`.
+    Call its ``get`` method to wait for the result (or the exception the
+    call raised), or pass a *callback* which is called from the worker thread
+    with the result once it's available. Since the workers can be shared,
+    one pool can serve many accounts at once::
+
+        >>> workers = galerts.ThreadPool(16)
+        >>> managers = [galerts.AsyncGAlertsManager(
+        ...     galerts.GAlertsManager(email, password), workers)
+        ...     for (email, password) in accounts]
+        >>> pending = [m.alerts() for m in managers]
+        >>> alerts = [p.get() for p in pending]
+
+    The :class:`Alert` objects involved are the same ones
+    :class:`GAlertsManager` works with.
+    """
+    def __init__(self, manager, workers=None):
+        """
+        :param manager: the :class:`GAlertsManager` to make calls on
+        :param workers: a :class:`ThreadPool` to make the calls from. If not
+            given, one with :attr:`GAlertsManager.concurrency` threads is
+            created.
+        """
+        self.manager = manager
+        self._own_workers = workers is None
+        if workers is None:
+            workers = ThreadPool(manager.concurrency)
+        self.workers = workers
+
+    @classmethod
+    def signin(cls, email, password, workers=None, callback=None, **kwds):
+        """
+        Signs in without blocking. The result is an
+        :class:`AsyncGAlertsManager` for the account.
+
+        Any additional keyword arguments are passed to
+        :class:`GAlertsManager`.
+        """
+        own_workers = workers is None
+        if own_workers:
+            workers = ThreadPool(kwds.get('concurrency',
+                GAlertsManager.CONCURRENCY))
+        def signin():
+            manager = cls(GAlertsManager(email, password, **kwds), workers)
+            manager._own_workers = own_workers
+            return manager
+        return workers.apply_async(signin, callback=callback)
+
+    def alerts(self, callback=None):
+        """
+        The result is a list of the :attr:`GAlertsManager.alerts`.
+        """
+        return self.workers.apply_async(list, (self.manager.alerts,),
+            callback=callback)
+
+    def iter_alerts(self, each, callback=None):
+        """
+        Calls *each* with every alert in :attr:`GAlertsManager.alerts`, from
+        the worker thread, as soon as the alert is available. The result is
+        the number of alerts.
+        """
+        def iterate():
+            count = 0
+            for alert in self.manager.alerts:
+                each(alert)
+                count += 1
+            return count
+        return self.workers.apply_async(iterate, callback=callback)
+
+    def create(self, query, type, callback=None, **kwds):
+        """
+        Calls :meth:`GAlertsManager.create` without blocking.
+        """
+        return self.workers.apply_async(self.manager.create, (query, type),
+            kwds, callback=callback)
+
+    def update(self, alert, callback=None):
+        """
+        Calls :meth:`GAlertsManager.update` without blocking.
+        """
+        return self.workers.apply_async(self.manager.update, (alert,),
+            callback=callback)
+
+    def delete(self, alert, callback=None):
+        """
+        Calls :meth:`GAlertsManager.delete` without blocking.
+        """
+        return self.workers.apply_async(self.manager.delete, (alert,),
+            callback=callback)
+
+    def close(self):
+        """
+        Closes the manager and, unless they were passed in, its workers.
+        """
+        if self._own_workers:
+            self.workers.close()
+        self.manager.close()
+
+
+class GAlertsManagerPool(object):
+    """
+    Manages the alerts of many Google accounts at once.
+
+    Holds a signed in :class:`GAlertsManager` for each account and runs
+    their operations on a shared set of worker threads. Each account's
+    operations run one at a time, in the order they were submitted, while
+    the accounts themselves take turns, so a long queue of operations for
+    one account doesn't hold up the others. Each account's operations can
+    also be limited to a given rate.
+
+    If *rate_limiter* (a :class:`TokenBucket`) is given, it's added to the
+    :attr:`GAlertsManager.rate_limiters` of every manager in the pool, to
+    limit the rate of the requests made for all accounts together.
+    """
+
+    #: Default number of worker threads shared by all accounts.
+    WORKERS = 8
+
+    def __init__(self, workers=WORKERS, rate_limiter=None):
+        self.rate_limiter = rate_limiter
+        self.managers = {}
+        self._limits = {}
+        self._queues = {}
+        # accounts with queued operations and none running, in the order
+        # they'll be served
+        self._ready = deque()
+        # accounts with an operation running
+        self._running = set()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._threads = []
+        for i in xrange(workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def add(self, email, password, rate=None, burst=1, **kwds):
+        """
+        Signs in to the account for *email* and adds it to the pool. Any
+        additional keyword arguments are passed to :class:`GAlertsManager`.
+        Returns the manager.
+
+        :param rate: if given, the maximum number of operations per second
+            to run for this account, on average
+        :param burst: the maximum number of operations to run for this
+            account in a burst without regard to *rate*
+        """
+        if self.rate_limiter is not None:
+            kwds['rate_limiters'] = list(kwds.get('rate_limiters', ())) + \
+                [self.rate_limiter]
+        return self.add_manager(GAlertsManager(email, password, **kwds),
+            rate=rate, burst=burst)
+
+    def add_manager(self, manager, rate=None, burst=1):
+        """
+        Adds an existing :class:`GAlertsManager` to the pool, as described
+        in :meth:`add`.
+        """
+        limiter = self.rate_limiter
+        if limiter is not None and limiter not in manager.rate_limiters:
+            manager.rate_limiters.append(limiter)
+        with self._cond:
+            self.managers[manager.email] = manager
+            self._queues.setdefault(manager.email, deque())
+            if rate is not None:
+                self._limits[manager.email] = TokenBucket(rate, burst)
+        return manager
+
+    def submit(self, email, func, *args, **kwds):
+        """
+        Schedules ``func(manager, *args, **kwds)``, where *manager* is the
+        manager for *email*, e.g.::
+
+            >>> task = pool.submit(email, GAlertsManager.create, query, type)
+
+        Returns a task object whose ``get`` method waits for the call to
+        finish and returns its result, or raises the exception it raised.
+        """
+        task = _Task(func, (self.managers[email],) + args, kwds)
+        with self._cond:
+            if self._closed:
+                raise ValueError('GAlertsManagerPool is closed')
+            queue = self._queues[email]
+            if not queue and email not in self._running:
+                self._ready.append(email)
+            queue.append(task)
+            self._cond.notify()
+        return task
+
+    def create(self, email, query, type, **kwds):
+        """
+        Schedules :meth:`GAlertsManager.create` for the account for *email*.
+        """
+        return self.submit(email, GAlertsManager.create, query, type, **kwds)
+
+    def update(self, alert):
+        """
+        Schedules :meth:`GAlertsManager.update` for the account *alert*
+        belongs to.
+        """
+        return self.submit(alert.email, GAlertsManager.update, alert)
+
+    def delete(self, alert):
+        """
+        Schedules :meth:`GAlertsManager.delete` for the account *alert*
+        belongs to.
+        """
+        return self.submit(alert.email, GAlertsManager.delete, alert)
+
+    @property
+    def alerts(self):
+        """
+        Lists the alerts of all the accounts in parallel and returns a
+        generator over all of them, in the order they arrive. Use
+        :attr:`Alert.email` to tell which account an alert belongs to.
+
+        If listing the alerts of any account fails, the exception is raised
+        once the alerts that arrived before the failure have been yielded.
+        """
+        results = Queue.Queue()
+        def list_alerts(manager):
+            try:
+                for alert in manager.alerts:
+                    results.put(alert)
+            finally:
+                results.put(None)
+        tasks = [self.submit(email, list_alerts) for email in self.managers]
+        remaining = len(tasks)
+        while remaining:
+            alert = results.get()
+            if alert is None:
+                remaining -= 1
+            else:
+                yield alert
+        for task in tasks:
+            task.get()
+
+    def close(self):
+        """
+        Waits for the scheduled operations to finish, then stops the
+        workers and closes the managers.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+        for manager in self.managers.itervalues():
+            manager.close()
+
+    def _work(self):
+        while True:
+            with self._cond:
+                task = self._next_task()
+            if task is None:
+                return
+            email, task = task
+            try:
+                task.run()
+            finally:
+                with self._cond:
+                    self._running.discard(email)
+                    if self._queues[email]:
+                        self._ready.append(email)
+                        self._cond.notify()
+                    elif self._closed:
+                        self._cond.notify_all()
+
+    def _next_task(self):
+        """
+        Waits for an operation that may run now and takes it off its queue,
+        serving accounts round-robin, and returns its account's email and
+        the operation. The account isn't served again until the operation
+        has run. Called with :attr:`_cond` held. Returns ``None`` once the
+        pool is closed and all operations have run.
+        """
+        while True:
+            if self._closed and not self._ready and not self._running:
+                return None
+            wait = None
+            for i in xrange(len(self._ready)):
+                email = self._ready.popleft()
+                queue = self._queues[email]
+                limit = self._limits.get(email)
+                if limit is None or limit.take():
+                    self._running.add(email)
+                    return email, queue.popleft()
+                self._ready.append(email)
+                delay = limit.delay()
+                wait = delay if wait is None else min(wait, delay)
+            self._cond.wait(wait)
+
+
+class AlertTable(object):
+    """
+    Holds alerts column by column, for fast analysis of large numbers of
+    them, e.g.::
+
+        >>> table = galerts.AlertTable(gam.alerts)
+        >>> table.count_by('type')
+        {'Everything': 9120, 'News': 812, 'Blogs': 68}
+        >>> feeds = table.filter(deliver=galerts.DELIVER_FEED)
+        >>> feeds.column('feedurl')
+        ['http://www.google.com/alerts/feeds/...', ...]
+
+    The enumerated columns (``type``, ``freq``, ``vol`` and ``deliver``) are
+    stored as arrays of one-byte codes and the others as lists, so counting,
+    filtering and grouping work on whole columns at a time instead of going
+    through an :class:`Alert` object per row.
+    """
+
+    #: The columns of a table, which are also the fields of the CSV and JSON
+    #: it's exported to and imported from.
+    COLUMNS = ('email', 's', 'query', 'type', 'freq', 'vol', 'deliver',
+        'feedurl')
+
+    # the names each coded column's codes stand for, in code order
+    _NAMES = {
+        'type': tuple(sorted(ALERT_TYPES)),
+        'freq': tuple(sorted(ALERT_FREQS)),
+        'vol': tuple(sorted(ALERT_VOLS)),
+        'deliver': tuple(sorted(DELIVER_TYPES)),
+        }
+    _CODES = dict((column, dict((name, code) for (code, name) in
+        enumerate(names))) for (column, names) in _NAMES.iteritems())
+
+    def __init__(self, alerts=()):
+        """
+        :param alerts: an iterable of :class:`Alert` objects, e.g.
+            :attr:`GAlertsManager.alerts`, to fill the table with
+        """
+        self._columns = dict((column, array('B') if column in self._NAMES
+            else []) for column in self.COLUMNS)
+        for alert in alerts:
+            self.append(alert)
+
+    def __len__(self):
+        return len(self._columns['s'])
+
+    def __getitem__(self, i):
+        """
+        Returns an :class:`Alert` for row *i*.
+        """
+        return Alert(*[self._value(column, i) for column in self.COLUMNS])
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def _value(self, column, i):
+        value = self._columns[column][i]
+        if column in self._NAMES:
+            return self._NAMES[column][value]
+        return value
+
+    def append(self, alert):
+        """
+        Adds a row for *alert*.
+        """
+        self._append_row(alert.email, alert._s, alert.query, alert.type,
+            alert.freq, alert.vol, alert.deliver, alert.feedurl)
+
+    def _append_row(self, *values):
+        for column, value in zip(self.COLUMNS, values):
+            if column in self._CODES:
+                value = self._CODES[column][value]
+            self._columns[column].append(value)
+
+    def column(self, column):
+        """
+        Returns a list of the values in *column*.
+        """
+        values = self._columns[column]
+        if column in self._NAMES:
+            return map(self._NAMES[column].__getitem__, values)
+        return list(values)
+
+    def take(self, rows):
+        """
+        Returns a new table of the given *rows*, a sequence of row numbers.
+        """
+        table = AlertTable()
+        if not rows:
+            return table
+        get = itemgetter(*rows)
+        for column, values in self._columns.iteritems():
+            taken = get(values)
+            if len(rows) == 1:
+                taken = (taken,)
+            table._columns[column].extend(taken)
+        return table
+
+    def _mask(self, column, wanted):
+        values = self._columns[column]
+        if callable(wanted):
+            if column in self._NAMES:
+                names = self._NAMES[column]
+                return [wanted(names[value]) for value in values]
+            return map(wanted, values)
+        if isinstance(wanted, basestring) or wanted is None:
+            wanted = (wanted,)
+        if column in self._CODES:
+            wanted = [self._CODES[column][name] for name in wanted]
+        wanted = frozenset(wanted)
+        return [value in wanted for value in values]
+
+    def filter(self, **criteria):
+        """
+        Returns a new table of the rows matching all of *criteria*, given as
+        keyword arguments named after the columns. Each criterion is either
+        a value, a collection of values, or a function of a value returning
+        whether it matches, e.g.::
+
+            >>> table.filter(type=(galerts.TYPE_NEWS, galerts.TYPE_BLOGS),
+            ...     query=lambda query: 'python' in query.lower())
+        """
+        rows = xrange(len(self))
+        for column, wanted in criteria.iteritems():
+            rows = list(compress(rows, self._mask(column, wanted)))
+            if not rows:
+                break
+            if len(rows) < len(self):
+                # the remaining criteria only need to look at these rows
+                return self.take(rows).filter(**dict((c, w) for (c, w)
+                    in criteria.iteritems() if c != column))
+        return self.take(rows)
+
+    def count_by(self, column):
+        """
+        Returns a dict mapping each value in *column* to how many rows have
+        it.
+        """
+        values = self._columns[column]
+        if column in self._NAMES:
+            counts = ((name, values.count(code)) for (code, name) in
+                enumerate(self._NAMES[column]))
+            return dict((name, count) for (name, count) in counts if count)
+        return dict(Counter(values))
+
+    def group_by(self, column):
+        """
+        Returns a dict mapping each value in *column* to a table of the rows
+        with that value.
+        """
+        rows = {}
+        for i, value in enumerate(self._columns[column]):
+            rows.setdefault(value, []).append(i)
+        if column in self._NAMES:
+            names = self._NAMES[column]
+            return dict((names[value], self.take(r)) for (value, r)
+                in rows.iteritems())
+        return dict((value, self.take(r)) for (value, r) in rows.iteritems())
+
+    def _keys(self, columns):
+        keys = []
+        for column in columns:
+            values = self._columns[column]
+            if column == 'query':
+                # ignore differences in case and spacing
+                values = [u' '.join(query.lower().split()) for query in values]
+            keys.append(values)
+        return zip(*keys)
+
+    def duplicates(self, columns=('query', 'type', 'deliver')):
+        """
+        Returns a list of lists of the numbers of rows that have the same
+        values in *columns*. Queries are compared ignoring case and spacing.
+        """
+        rows = {}
+        for i, key in enumerate(self._keys(columns)):
+            rows.setdefault(key, []).append(i)
+        return sorted(r for r in rows.itervalues() if len(r) > 1)
+
+    def dedupe(self, columns=('query', 'type', 'deliver')):
+        """
+        Returns a new table without the rows found to be duplicates of
+        earlier rows by :meth:`duplicates`.
+        """
+        seen = set()
+        rows = []
+        for i, key in enumerate(self._keys(columns)):
+            if key not in seen:
+                seen.add(key)
+                rows.append(i)
+        return self.take(rows)
+
+    def _rows(self):
+        columns = [self.column(column) for column in self.COLUMNS]
+        return zip(*columns)
+
+    def to_csv(self, f):
+        """
+        Writes the table to the file *f* as CSV, with a header row of the
+        column names. Text is encoded as UTF-8.
+        """
+        writer = csv.writer(f)
+        writer.writerow(self.COLUMNS)
+        for row in self._rows():
+            writer.writerow(self._to_text(row))
+
+    @staticmethod
+    def _to_text(row):
+        return [u'' if value is None else value.encode('utf-8')
+            if isinstance(value, unicode) else value for value in row]
+
+    @classmethod
+    def from_csv(cls, f):
+        """
+        Reads a table from the file *f*, written by :meth:`to_csv`.
+        """
+        table = cls()
+        reader = csv.reader(f)
+        header = next(reader)
+        for row in reader:
+            values = dict(zip(header, row))
+            table._append_row(*[cls._from_text(column, values.get(column))
+                for column in cls.COLUMNS])
+        return table
+
+    @staticmethod
+    def _from_text(column, value):
+        if not value and column in ('s', 'feedurl'):
+            return None
+        if column == 'query':
+            return value.decode('utf-8')
+        return value
+
+    def to_json(self, f):
+        """
+        Writes the table to the file *f* as a JSON array of objects, one per
+        row.
+        """
+        json.dump([dict(zip(self.COLUMNS, row)) for row in self._rows()], f)
+
+    @classmethod
+    def from_json(cls, f):
+        """
+        Reads a table from the file *f*, written by :meth:`to_json`.
+        """
+        table = cls()
+        for row in json.load(f):
+            table._append_row(*[cls._from_json(column, row.get(column))
+                for column in cls.COLUMNS])
+        return table
+
+    @staticmethod
+    def _from_json(column, value):
+        # json gives us unicode for everything, but only queries are unicode
+        if column != 'query' and isinstance(value, unicode):
+            return value.encode('utf-8')
+        return value
+
+
+def _query_key(query):
+    """
+    Returns the key alerts with *query* are indexed under by
+    :class:`AlertIndex`: the query in lower case, with runs of whitespace
+    collapsed to single spaces.
+    """
+    return u' '.join(query.lower().split())
+
+
+class AlertIndex(object):
+    """
+    Holds alerts with hash indexes on their ids (``s`` values), queries, feed
+    urls, and types and delivery methods, so they can be looked up in
+    constant time rather than by going through all of them::
+
+        >>> index = gam.index
+        >>> index.find_by_feed('http://www.google.com/alerts/feeds/...')
+        <Alert for "Cake Man Cornelius" at ...>
+
+    Queries are looked up without regard to case or to how they're spaced.
+    Like :attr:`GAlertsManager.alerts`, each lookup returns fresh copies of
+    the alerts, so modifying them doesn't affect the index. Iterating over
+    the index yields the alerts in the order they were added.
+
+    The index can be read from any thread while another changes it.
+    """
+    def __init__(self, alerts=()):
+        """
+        :param alerts: an iterable of :class:`Alert` objects, e.g.
+            :attr:`GAlertsManager.alerts`, to fill the index with. Alerts
+            without an id (``s`` value) can't be indexed.
+        """
+        self._lock = threading.Lock()
+        self._alerts = OrderedDict()
+        self._by_query = {}
+        self._by_feed = {}
+        self._by_kind = {}
+        for alert in alerts:
+            self.add(alert)
+
+    @classmethod
+    def _owning(cls, alerts):
+        # an index of *alerts* themselves, which mustn't be modified
+        index = cls()
+        with index._lock:
+            for alert in alerts:
+                index._insert(alert)
+        return index
+
+    def __len__(self):
+        return len(self._alerts)
+
+    def __contains__(self, s):
+        return s in self._alerts
+
+    def __iter__(self):
+        return (alert._copy() for alert in self._values())
+
+    def get_by_id(self, s):
+        """
+        Returns the alert whose ``s`` value is *s*, or ``None``.
+        """
+        alert = self._alerts.get(s)
+        return alert._copy() if alert is not None else None
+
+    def find_by_query(self, query):
+        """
+        Returns a list of the alerts for *query*, ignoring differences in
+        case and whitespace, in no particular order.
+        """
+        return self._find(self._by_query, _query_key(query))
+
+    def find_by_feed(self, feedurl):
+        """
+        Returns the alert delivered to the feed *feedurl*, or ``None``.
+        """
+        s = self._by_feed.get(feedurl)
+        return self.get_by_id(s) if s is not None else None
+
+    def find_by_type(self, type, deliver):
+        """
+        Returns a list of the alerts of type *type* delivered by *deliver*,
+        in no particular order.
+        """
+        # indexed by the values Google uses, as stored by :class:`Alert`
+        return self._find(self._by_kind, (ALERT_TYPES.get(type),
+            DELIVER_TYPES.get(deliver)))
+
+    def _find(self, index, key):
+        with self._lock:
+            alerts = [self._alerts[s] for s in index.get(key, ())]
+        return [alert._copy() for alert in alerts]
+
+    def add(self, alert):
+        """
+        Adds a copy of *alert*, replacing any alert with the same ``s``
+        value (and keeping its place).
+        """
+        self._add(alert._copy())
+
+    def remove(self, s):
+        """
+        Removes the alert whose ``s`` value is *s*, if there is one.
+        """
+        with self._lock:
+            self._remove(s)
+
+    def _add(self, alert):
+        # takes ownership of *alert*
+        with self._lock:
+            self._insert(alert)
+
+    def _insert(self, alert):
+        s = alert._s
+        if s is None:
+            raise ValueError('Alerts without an s value cannot be indexed')
+        old = self._alerts.get(s)
+        if old is not None:
+            self._unindex(old)
+        self._alerts[s] = alert
+        self._by_query.setdefault(_query_key(alert._query), set()).add(s)
+        self._by_kind.setdefault((alert._type, alert._deliver), set()).add(s)
+        if alert._feedurl:
+            self._by_feed[alert._feedurl] = s
+
+    def _remove(self, s):
+        alert = self._alerts.pop(s, None)
+        if alert is not None:
+            self._unindex(alert)
+
+    def _unindex(self, alert):
+        s = alert._s
+        for index, key in ((self._by_query, _query_key(alert._query)),
+                (self._by_kind, (alert._type, alert._deliver))):
+            ids = index.get(key)
+            if ids is not None:
+                ids.discard(s)
+                if not ids:
+                    del index[key]
+        if alert._feedurl and self._by_feed.get(alert._feedurl) == s:
+            del self._by_feed[alert._feedurl]
+
+    def _get(self, s):
+        # the indexed alert itself, which mustn't be modified
+        return self._alerts.get(s)
+
+    def _values(self):
+        # the indexed alerts themselves, which mustn't be modified
+        with self._lock:
+            return self._alerts.values()
+
+
+_QUERY_TOKEN_RE = re.compile(r'(-?)"([^"]*)"?|(\S+)')
+
+def _query_terms(query):
+    """
+    Returns the terms of *query* in order, normalized, with ``None`` for
+    each ``OR`` operator. Terms are lower case, without a leading "+". A
+    quoted phrase is a single term with its whitespace collapsed, so a
+    quoted word is the same term as the word itself. Excluded terms keep
+    their leading "-".
+
+    Parentheses group terms in ways the normal forms of :func:`_query_form`
+    can't express, e.g. ``(apple pie) OR cake``, so a query with any
+    outside quotes has a single term instead: a tuple of its
+    :func:`_query_key`, which only the same query shares.
+    """
+    terms = []
+    for minus, phrase, word in _QUERY_TOKEN_RE.findall(query):
+        if word:
+            if word in ('OR', '|'):
+                terms.append(None)
+                continue
+            if '(' in word or ')' in word:
+                return [(_query_key(query),)]
+            term = word.lstrip('+').lower()
+        else:
+            term = u' '.join(phrase.lower().split())
+            term = term and minus + term
+        if term:
+            terms.append(term)
+    return terms
+
+def _query_form(terms):
+    """
+    Returns the normal form of a query with *terms* (see
+    :func:`_query_terms`): a frozenset of the query's clauses, all of which
+    a result must match, each a frozenset of terms joined by ``OR``, any of
+    which it may match. Clauses which can't narrow the results because
+    they include all the terms of another clause are left out, so queries
+    which match the same results in the same way have the same form.
+    """
+    clauses = []
+    join = False
+    for term in terms:
+        if term is None:
+            join = bool(clauses)
+        elif join:
+            clauses[-1].add(term)
+            join = False
+        else:
+            clauses.append(set([term]))
+    clauses = set(frozenset(clause) for clause in clauses)
+    return frozenset(clause for clause in clauses
+        if not any(other < clause for other in clauses))
+
+def _subsumes(form, other):
+    """
+    Returns whether every result matching the query of normal form *other*
+    also matches the query of normal form *form*: whether each clause of
+    *form* allows every term of some clause of *other*.
+    """
+    return all(any(clause >= narrower for narrower in other)
+        for clause in form)
+
+
+class Redundancy(object):
+    """
+    Says that :attr:`alert` is redundant, because every result it delivers
+    is also delivered by :attr:`covered_by`, as found by
+    :func:`find_redundant_alerts`.
+
+    :attr:`kind` says how: ``'exact'`` if the alerts' queries are the same
+    but for case, spacing, and quoting of single words, ``'reordered'`` if
+    they're the same but for the order of their terms, or ``'subsumed'`` if
+    the query of :attr:`covered_by` is broader, e.g. has fewer terms or more
+    alternatives joined by ``OR``.
+    """
+    __slots__ = ('alert', 'kind', 'covered_by')
+
+    def __init__(self, alert, kind, covered_by):
+        self.alert = alert
+        self.kind = kind
+        self.covered_by = covered_by
+
+    def __repr__(self):
+        return '<%s %s: %r covered by %r>' % (self.__class__.__name__,
+            self.kind, self.alert, self.covered_by)
+
+
+def find_redundant_alerts(alerts):
+    """
+    Returns a list of a :class:`Redundancy` for each of *alerts* which only
+    delivers results that another of them also delivers, e.g. from the
+    alerts of many accounts. Of alerts with equivalent queries, the first
+    is kept, and the others are redundant; of the rest, an alert is
+    redundant if the query of another is broader.
+
+    Alerts only cover each other if they're of the same type and delivered
+    the same way (and for email alerts, to the same address), and if the
+    covering alert delivers all results rather than only the best ones, or
+    as often, when the other does. Redundant alerts are covered by an alert
+    which is not redundant itself, so all of them can be deleted at once.
+
+    Rather than comparing every pair of queries, each query is only
+    compared with those sharing a term in an inverted index, so even tens
+    of thousands of alerts are checked quickly.
+    """
+    groups = {}
+    for alert in alerts:
+        terms = _query_terms(alert.query)
+        form = _query_form(terms)
+        if not form:
+            continue
+        key = (alert._type, alert._deliver,
+            alert.email if alert.deliver == DELIVER_EMAIL else None)
+        groups.setdefault(key, []).append((alert, terms, form))
+    redundant = []
+    for members in groups.itervalues():
+        redundant.extend(_find_redundant(members))
+    return redundant
+
+def _find_redundant(members):
+    """
+    Does the work of :func:`find_redundant_alerts` for a group of alerts
+    which could cover each other, given as ``(alert, terms, form)``
+    tuples.
+    """
+    # alerts with the same form, first the one to keep, then the others
+    # with their terms, and the broadest volume and frequency among them
+    classes = OrderedDict()
+    for alert, terms, form in members:
+        cls = classes.get(form)
+        if cls is None:
+            classes[form] = [alert, terms, [], int(alert._vol),
+                int(alert._freq)]
+            continue
+        cls[2].append((alert, 'exact' if terms == cls[1] else 'reordered'))
+        cls[3] = max(cls[3], int(alert._vol))
+        cls[4] = min(cls[4], int(alert._freq))
+    email = members[0][0].deliver == DELIVER_EMAIL
+
+    def covers(form, other):
+        # larger volume values mean more results, smaller frequency values
+        # more often
+        cls, other_cls = classes[form], classes[other]
+        return cls[3] >= other_cls[3] and (not email or
+            cls[4] <= other_cls[4]) and _subsumes(form, other)
+
+    # a form can only subsume another if all the terms of one of its
+    # clauses are in the other, so each form is indexed by the terms of the
+    # clause whose terms are in the fewest forms, and only compared with
+    # the forms which have one of those terms
+    frequency = Counter()
+    for form in classes:
+        frequency.update(set(term for clause in form for term in clause))
+    index = {}
+    for form in classes:
+        clause = min(form, key=lambda clause: sum(frequency[term]
+            for term in clause))
+        for term in clause:
+            index.setdefault(term, []).append(form)
+    covering = {}
+    for form in classes:
+        candidates = set()
+        for clause in form:
+            for term in clause:
+                candidates.update(index.get(term, ()))
+        candidates.discard(form)
+        found = [other for other in candidates if covers(other, form)]
+        if found:
+            covering[form] = found
+
+    redundant = []
+    for form, cls in classes.iteritems():
+        if form in covering:
+            # covering is transitive, so one of the forms found covers all
+            # the others and isn't covered itself
+            keeper = classes[next(other for other in covering[form]
+                if other not in covering)][0]
+            for alert in [cls[0]] + [alert for (alert, kind) in cls[2]]:
+                redundant.append(Redundancy(alert, 'subsumed', keeper))
+        else:
+            for alert, kind in cls[2]:
+                redundant.append(Redundancy(alert, kind, cls[0]))
+    return redundant
+
+def consolidate_alerts(alerts):
+    """
+    Proposes how to consolidate *alerts* so that none of them is redundant,
+    as found by :func:`find_redundant_alerts`. Returns a tuple of a list of
+    alerts to update and a list of alerts to delete, which can be passed to
+    :meth:`GAlertsManager.update_many` and :meth:`GAlertsManager.delete_many`
+    (or, for the alerts of many accounts, :meth:`GAlertsManagerPool.update`
+    and :meth:`GAlertsManagerPool.delete`)::
+
+        >>> to_update, to_delete = galerts.consolidate_alerts(gam.alerts)
+        >>> gam.update_many(to_update)
+        >>> gam.delete_many(to_delete)
+
+    Alerts are updated when an equivalent alert being deleted delivers more
+    results or delivers them more often, so that nothing is lost; the
+    alerts to update are copies, and *alerts* aren't modified.
+    """
+    redundancies = find_redundant_alerts(alerts)
+    to_update = OrderedDict()
+    for redundancy in redundancies:
+        alert, keeper = redundancy.alert, redundancy.covered_by
+        if redundancy.kind == 'subsumed':
+            continue
+        updated = to_update.get(id(keeper), keeper)
+        if int(alert._vol) > int(updated._vol):
+            updated = to_update[id(keeper)] = updated._copy()
+            updated.vol = alert.vol
+        if alert.deliver == DELIVER_EMAIL and \
+                int(alert._freq) < int(updated._freq):
+            updated = to_update[id(keeper)] = updated._copy()
+            updated.freq = alert.freq
+    return (to_update.values(),
+        [redundancy.alert for redundancy in redundancies])
+
+
+#: The file formats :func:`write_alerts` and :func:`read_alerts` support.
+ALERT_FORMATS = ('jsonl', 'csv')
+
+def write_alerts(alerts, f, format='jsonl'):
+    """
+    Writes *alerts*, an iterable of :class:`Alert` objects, to the file *f*
+    as they come, one per line, with all the fields of
+    :attr:`AlertTable.COLUMNS`. Returns the number of alerts written.
+
+    :param format: ``'jsonl'`` to write JSON Lines (a JSON object per line)
+        or ``'csv'`` to write CSV with a header row, as
+        :meth:`AlertTable.to_csv` does
+    """
+    if format not in ALERT_FORMATS:
+        raise ValueError('Unknown format: %r' % format)
+    if format == 'csv':
+        writer = csv.writer(f)
+        writer.writerow(AlertTable.COLUMNS)
+    n = 0
+    for alert in alerts:
+        row = (alert.email, alert._s, alert.query, alert.type, alert.freq,
+            alert.vol, alert.deliver, alert.feedurl)
+        if format == 'csv':
+            writer.writerow(AlertTable._to_text(row))
+        else:
+            f.write(json.dumps(dict(zip(AlertTable.COLUMNS, row))) + '\n')
+        n += 1
+    return n
+
+def read_alerts(f, format='jsonl'):
+    """
+    Yields an :class:`Alert` for each alert in the file *f*, written by
+    :func:`write_alerts` in *format*, reading the file only as far as
+    needed.
+    """
+    if format not in ALERT_FORMATS:
+        raise ValueError('Unknown format: %r' % format)
+    if format == 'csv':
+        reader = csv.reader(f)
+        header = next(reader)
+        for row in reader:
+            values = dict(zip(header, row))
+            yield Alert(*[AlertTable._from_text(column, values.get(column))
+                for column in AlertTable.COLUMNS])
+        return
+    for line in f:
+        if not line.strip():
+            continue
+        values = json.loads(line)
+        yield Alert(*[AlertTable._from_json(column, values.get(column))
+            for column in AlertTable.COLUMNS])
+
+
+_ATOM = '{http://www.w3.org/2005/Atom}'
+
+class FeedEntry(object):
+    """
+    A result delivered to an alert's feed.
+
+    :attr:`id` identifies the result (it's the link if the feed gives no
+    id), :attr:`published` and :attr:`updated` are the timestamps the feed
+    gives, as strings, and :attr:`content` is the summary of the result as
+    html. Entries are equal if their ids are.
+    """
+    __slots__ = ('id', 'title', 'link', 'published', 'updated', 'content')
+
+    def __init__(self, id, title, link, published=None, updated=None,
+            content=None):
+        self.id = id
+        self.title = title
+        self.link = link
+        self.published = published
+        self.updated = updated
+        self.content = content
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __eq__(self, other):
+        return isinstance(other, FeedEntry) and self.id == other.id
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, self.id.encode('utf-8'))
+
+
+def _parse_feed(f):
+    """
+    Yields a :class:`FeedEntry` for each entry of the Atom (or RSS) feed read
+    from the file *f*, as soon as it's been read, without building a tree of
+    the whole feed.
+    """
+    def text(elem, *tags):
+        for tag in tags:
+            child = elem.find(tag)
+            if child is not None and child.text is not None:
+                return unicode(child.text)
+        return None
+    from xml.etree import cElementTree as ElementTree
+    for event, elem in ElementTree.iterparse(f):
+        if elem.tag == _ATOM + 'entry':
+            link = elem.find(_ATOM + 'link')
+            link = link is not None and link.get('href') or None
+            entry = FeedEntry(text(elem, _ATOM + 'id') or link,
+                text(elem, _ATOM + 'title'), link,
+                text(elem, _ATOM + 'published'), text(elem, _ATOM + 'updated'),
+                text(elem, _ATOM + 'content', _ATOM + 'summary'))
+        elif elem.tag == 'item':
+            link = text(elem, 'link')
+            entry = FeedEntry(text(elem, 'guid') or link,
+                text(elem, 'title'), link, text(elem, 'pubDate'), None,
+                text(elem, 'description'))
+        else:
+            continue
+        elem.clear()
+        if entry.id is not None:
+            yield entry
+
+
+class FeedFetcher(object):
+    """
+    Fetches the results of the feed alerts of a :class:`GAlertsManager`'s
+    account, many feeds at a time::
+
+        >>> fetcher = galerts.FeedFetcher(gam)
+        >>> for alert, entry in fetcher.fetch():
+        ...     print alert.query, entry.title, entry.link
+
+    Feeds are requested through the manager, so its retry policy, circuit
+    breaker, rate limits, and hooks apply. Each request is conditional on
+    the feed having changed since it was last fetched (using its ETag and
+    Last-Modified headers), and each result is only yielded the first time
+    any feed delivers it, so calling :meth:`fetch` again yields just the new
+    results.
+    """
+    def __init__(self, manager, concurrency=None):
+        """
+        :param concurrency: the maximum number of feeds to fetch at once.
+            Defaults to the manager's :attr:`GAlertsManager.concurrency`.
+        """
+        self.manager = manager
+        self.concurrency = concurrency or manager.concurrency
+        #: ``(etag, last_modified)`` by feed url, for conditional requests
+        self.validators = {}
+        #: ids of the results yielded so far
+        self.seen = set()
+        #: ``(alert, error)`` for each feed that couldn't be fetched by the
+        #: last call to :meth:`fetch`
+        self.errors = []
+        self._workers = None
+
+    def fetch(self, alerts=None):
+        """
+        Fetches the feeds of *alerts* concurrently, defaulting to all of the
+        account's feed alerts, and yields an ``(alert, entry)`` pair for each
+        result not seen before, as each feed is read. The errors raised for
+        feeds that couldn't be fetched are collected in :attr:`errors`.
+        """
+        if alerts is None:
+            alerts = self.manager.alerts
+        alerts = [alert for alert in alerts
+            if alert.deliver == DELIVER_FEED and alert.feedurl]
+        self.errors = []
+        for alert, entries, error in self._fetch_feeds(alerts):
+            if error is not None:
+                self.errors.append((alert, error))
+                continue
+            for entry in entries:
+                if entry.id not in self.seen:
+                    self.seen.add(entry.id)
+                    yield alert, entry
+
+    def _fetch_feeds(self, alerts):
+        """
+        Yields the result of :meth:`_fetch_feed` for each of *alerts* as it
+        finishes, fetching up to :attr:`concurrency` feeds at once.
+        """
+        if self._workers is None:
+            self._workers = ThreadPool(self.concurrency)
+        return self._workers.imap_unordered(self._fetch_feed, alerts)
+
+    def _fetch_feed(self, alert):
+        """
+        Returns ``(alert, entries, error)`` for the feed of *alert*, where
+        *entries* is empty if the feed hasn't changed.
+        """
+        url = alert.feedurl
+        headers = _conditional_headers(self.validators.get(url))
+        try:
+            response = self.manager._request(url, op='feed', headers=headers)
+            status = response.getcode()
+            if status == 304:
+                self.manager._discard(response)
+                return alert, (), None
+            if status != 200:
+                raise UnexpectedResponseError(status,
+                    response.info().headers, self.manager._read(response))
+            event = getattr(response, 'event', None)
+            if event is not None:
+                start, read = time.time(), event.read
+            try:
+                entries = list(_parse_feed(response))
+            finally:
+                if event is not None:
+                    # the time not spent reading was spent parsing
+                    event.parse += time.time() - start - (event.read - read)
+                response.close()
+        except (UnexpectedResponseError, CircuitOpenError, urllib2.URLError,
+                socket.error, httplib.HTTPException, SyntaxError), e:
+            return alert, (), e
+        self.validators[url] = _validators(response) or (None, None)
+        return alert, entries, None
+
+    def close(self):
+        """
+        Stops the worker threads. The fetcher can still be used afterwards.
+        """
+        workers, self._workers = self._workers, None
+        if workers is not None:
+            workers.close()
+
+
+_RFC3339_RE = re.compile(r'(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)'
+    r'(?:\.\d+)?(Z|[+-]\d\d:?\d\d)?$')
+
+def _timestamp(value):
+    """
+    Returns the time given by the Atom (RFC 3339) or RSS (RFC 822) date
+    *value* in seconds since the epoch, or ``None`` if it can't be parsed.
+    """
+    if not value:
+        return None
+    import calendar
+    from email.utils import mktime_tz, parsedate_tz
+    match = _RFC3339_RE.match(value.strip())
+    if match is None:
+        date = parsedate_tz(value)
+        return mktime_tz(date) if date is not None else None
+    t = calendar.timegm([int(n) for n in match.groups()[:6]])
+    zone = match.group(7)
+    if zone and zone != 'Z':
+        offset = int(zone[1:3]) * 3600 + int(zone[-2:]) * 60
+        t += offset if zone[0] == '-' else -offset
+    return t
+
+
+class _FeedState(object):
+    """
+    What a :class:`FeedPoller` knows about a feed: the ids of the entries
+    it had when last polled, its estimated rate of new entries per second,
+    the interval it's polled at, and when it was last and will next be
+    polled.
+    """
+    __slots__ = ('ids', 'rate', 'interval', 'polled', 'due')
+
+    def __init__(self, ids=(), rate=None, interval=None, polled=None,
+            due=None):
+        self.ids = set(ids)
+        self.rate = rate
+        self.interval = interval
+        self.polled = polled
+        self.due = due
+
+
+class FeedPoller(object):
+    """
+    Polls the feeds of a :class:`GAlertsManager`'s feed alerts indefinitely,
+    each at its own interval, which adapts to how often the feed gets new
+    entries: busy feeds are polled often, so their results arrive soon
+    after they're published, and quiet ones rarely, to save requests.
+
+    Each feed's rate of new entries is first estimated from the timestamps
+    of the entries it has, then updated after each poll from the number of
+    new entries since the last one, as an exponentially weighted moving
+    average. A feed is polled about as often as it's expected to get a new
+    entry, but no more often than every *min_interval* seconds and no less
+    often than every *max_interval* seconds. Feeds that fail are retried at
+    twice their interval. The feeds due next are kept in a priority queue,
+    and the feeds due at the same time are fetched concurrently by a
+    :class:`FeedFetcher`, so conditional requests are used.
+
+    The alerts are listed again every *refresh_interval* seconds to pick up
+    new and deleted feed alerts. If *state_file* is given, the state of
+    every feed is saved to it after each poll and loaded from it on startup,
+    so a restarted poller carries on where it left off.
+    """
+
+    #: Default minimum number of seconds between polls of a feed.
+    MIN_INTERVAL = 60
+
+    #: Default maximum number of seconds between polls of a feed.
+    MAX_INTERVAL = 6 * 60 * 60
+
+    #: Default number of seconds between listings of the alerts.
+    REFRESH_INTERVAL = 15 * 60
+
+    #: Weight of the latest poll in a feed's estimated rate of new entries.
+    SMOOTHING = 0.3
+
+    def __init__(self, manager, state_file=None, min_interval=MIN_INTERVAL,
+            max_interval=MAX_INTERVAL, refresh_interval=REFRESH_INTERVAL,
+            concurrency=None):
+        self.manager = manager
+        self.fetcher = FeedFetcher(manager, concurrency)
+        self.state_file = state_file
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.refresh_interval = refresh_interval
+        #: ``(alert, error)`` for each feed (or the listing, with ``None``
+        #: for the alert) that failed during the last :meth:`poll`
+        self.errors = []
+        self._feeds = {}
+        self._alerts = {}
+        # (due, feed url), with outdated items left in place and skipped
+        self._queue = []
+        self._refreshed = None
+        if state_file is not None:
+            self._load()
+
+    def poll(self):
+        """
+        Polls the feeds that are due, and returns a list of ``(alert,
+        entry)`` pairs for their new entries.
+        """
+        now = time.time()
+        self.errors = []
+        self._refresh(now)
+        due = []
+        while self._queue and self._queue[0][0] <= now:
+            when, url = heapq.heappop(self._queue)
+            state = self._feeds.get(url)
+            if state is not None and state.due == when:
+                due.append(self._alerts[url])
+        results = []
+        for alert, entries, error in self.fetcher._fetch_feeds(due):
+            state = self._feeds[alert.feedurl]
+            if error is not None:
+                self.errors.append((alert, error))
+                state.interval = min(self.max_interval,
+                    2 * (state.interval or self.min_interval))
+            else:
+                new = [entry for entry in entries
+                    if entry.id not in state.ids]
+                self._adapt(state, new, entries, now)
+                if entries:
+                    state.ids = set(entry.id for entry in entries)
+                state.polled = now
+                results.extend((alert, entry) for entry in new)
+            state.due = now + state.interval
+            heapq.heappush(self._queue, (state.due, alert.feedurl))
+        if self.state_file is not None:
+            self._save()
+        return results
+
+    def next_poll(self):
+        """
+        Returns the number of seconds until :meth:`poll` has work to do.
+        """
+        when = self._refreshed + self.refresh_interval \
+            if self._refreshed is not None else 0
+        if self._queue:
+            when = min(when, self._queue[0][0])
+        return max(0, when - time.time())
+
+    def run(self, callback, stop=None):
+        """
+        Polls until *stop* (a :class:`threading.Event`) is set, if ever,
+        calling ``callback(alert, entry)`` for each new entry and sleeping
+        in between.
+        """
+        if stop is None:
+            stop = threading.Event()
+        while not stop.is_set():
+            for alert, entry in self.poll():
+                callback(alert, entry)
+            stop.wait(self.next_poll())
+
+    def close(self):
+        self.fetcher.close()
+
+    def _adapt(self, state, new, entries, now):
+        if state.polled is None:
+            # first poll: estimate the rate from the entries' timestamps
+            times = [t for t in (_timestamp(entry.published or entry.updated)
+                for entry in entries) if t is not None]
+            if len(times) > 1 and max(times) > min(times):
+                state.rate = (len(times) - 1) / float(max(times) - min(times))
+        elif now > state.polled:
+            rate = len(new) / (now - state.polled)
+            state.rate = rate if state.rate is None else \
+                self.SMOOTHING * rate + (1 - self.SMOOTHING) * state.rate
+        interval = 1 / state.rate if state.rate else self.max_interval
+        state.interval = min(self.max_interval,
+            max(self.min_interval, interval))
+
+    def _refresh(self, now):
+        """
+        Lists the alerts if it's time to, scheduling new feeds right away and
+        forgetting deleted ones.
+        """
+        if self._refreshed is not None and \
+                now < self._refreshed + self.refresh_interval:
+            return
+        try:
+            alerts = dict((alert.feedurl, alert)
+                for alert in self.manager.alerts
+                if alert.deliver == DELIVER_FEED and alert.feedurl)
+        except (UnexpectedResponseError, CircuitOpenError, urllib2.URLError,
+                socket.error, httplib.HTTPException), e:
+            # keep polling the feeds we know of, and list them again later
+            self.errors.append((None, e))
+            self._refreshed = now
+            return
+        self._refreshed = now
+        for url in set(self._feeds) - set(alerts):
+            del self._feeds[url]
+            self.fetcher.validators.pop(url, None)
+        for url in alerts:
+            state = self._feeds.get(url)
+            if state is None:
+                state = self._feeds[url] = _FeedState(due=now)
+            if url not in self._alerts:
+                if state.due is None:
+                    state.due = now
+                heapq.heappush(self._queue, (state.due, url))
+        self._alerts = alerts
+
+    def _load(self):
+        try:
+            with open(self.state_file) as f:
+                saved = json.load(f)
+        except (IOError, ValueError):
+            return
+        for url, values in saved.get('feeds', {}).iteritems():
+            self._feeds[str(url)] = _FeedState(**dict((str(k), v)
+                for (k, v) in values.iteritems()))
+        for url, validators in saved.get('validators', {}).iteritems():
+            self.fetcher.validators[str(url)] = tuple(validators)
+
+    def _save(self):
+        saved = {
+            'feeds': dict((url, {
+                'ids': list(state.ids),
+                'rate': state.rate,
+                'interval': state.interval,
+                'polled': state.polled,
+                'due': state.due,
+                }) for (url, state) in self._feeds.iteritems()),
+            'validators': self.fetcher.validators,
+            }
+        # write a new file and move it into place, so an interruption can't
+        # leave a truncated state file behind
+        with open(self.state_file + '.tmp', 'w') as f:
+            json.dump(saved, f)
+        os.rename(self.state_file + '.tmp', self.state_file)
+
+
+#: The operations a file read by ``galerts apply`` may contain.
+OPERATIONS = ('create', 'update', 'delete')
+
+def _read_operations(f, format='jsonl'):
+    """
+    Yields a dict of the values of each operation in the file *f*, one per
+    line in *format* (see :func:`read_alerts`), with an ``op`` field naming
+    one of :data:`OPERATIONS` and the alert fields it sets, as written by
+    :func:`write_alerts`. Empty values are left out.
+    """
+    if format not in ALERT_FORMATS:
+        raise ValueError('Unknown format: %r' % format)
+    if format == 'csv':
+        reader = csv.reader(f)
+        header = next(reader)
+        for row in reader:
+            yield dict((column, AlertTable._from_text(column, value))
+                for (column, value) in zip(header, row) if value)
+        return
+    for line in f:
+        if not line.strip():
+            continue
+        yield dict((str(column), AlertTable._from_json(str(column), value))
+            for (column, value) in json.loads(line).iteritems()
+            if value not in (None, ''))
+
+def _apply_operations(gam, operations):
+    """
+    Carries out *operations*, dicts as yielded by :func:`_read_operations`,
+    with :class:`GAlertsManager` *gam*, and returns a list of ``(i, op,
+    error)`` tuples for the *i*\ th operations that failed.
+
+    Updates and deletions name their alert by its ``s`` value, so the
+    alerts are listed (once) if there are any. As in
+    :meth:`GAlertsManager.sync`, the alerts to delete are deleted first, then
+    those to update are updated, and then the new ones are created, each
+    group in one batch.
+    """
+    failed = []
+    existing = None
+    batches = dict((op, []) for op in OPERATIONS)
+    for i, values in enumerate(operations):
+        op = values.pop('op', None)
+        try:
+            if op not in OPERATIONS:
+                raise ValueError('Unknown operation: %r' % op)
+            if op == 'create':
+                if not values.get('query'):
+                    raise ValueError('No query to create an alert for')
+                alert = Alert(gam.email, None, u'', TYPE_EVERYTHING,
+                    FREQ_ONCE_A_DAY, VOL_ONLY_BEST, DELIVER_FEED)
+            else:
+                if existing is None:
+                    existing = dict((alert._s, alert) for alert in gam.alerts)
+                alert = existing.get(values.get('s'))
+                if alert is None:
+                    raise ValueError('No alert with s=%r' % values.get('s'))
+            if op != 'delete':
+                for field in _MODIFIABLE:
+                    if field in values:
+                        setattr(alert, field, values[field])
+        except ValueError, e:
+            failed.append((i, op, e))
+            continue
+        item = GAlertsManager._create_kwds(alert) if op == 'create' else alert
+        batches[op].append((i, item))
+    for op, func in (('delete', gam.delete_many), ('update', gam.update_many),
+            ('create', gam.create_many)):
+        batch = batches[op]
+        if not batch:
+            continue
+        positions, items = zip(*batch)
+        results = func(list(items))
+        failed.extend((i, op, error) for (i, (result, error))
+            in zip(positions, results) if error is not None)
+    failed.sort(key=itemgetter(0))
+    return failed
+
+def main(argv=None):
+    """
+    Runs the ``galerts`` command. Without arguments it prompts for what to
+    do; otherwise it runs the subcommand given, e.g.::
+
+        $ galerts --email cornelius list --format csv > alerts.csv
+        $ galerts --email cornelius create 'Cake Man Cornelius' --type News
+        $ galerts --email cornelius delete 12345abcde
+        $ galerts --email cornelius apply changes.jsonl
+
+    The password is read from the ``GALERTS_PASSWORD`` environment variable,
+    or prompted for. Each run signs in once and lists the alerts at most
+    once, so ``apply``, which reads any number of create, update, and delete
+    operations from a file (or ``-`` for stdin), is the way to make many
+    changes at once. Failed operations are reported on stderr, and make the
+    command exit with status 1.
+    """
+    import argparse
+    from getpass import getpass
+    if argv is None:
+        argv = sys.argv[1:]
+    if not argv:
+        return _interactive()
+
+    parser = argparse.ArgumentParser(prog='galerts',
+        description='Manage Google Alerts.')
+    parser.add_argument('--email', default=os.environ.get('GALERTS_EMAIL'),
+        help='the account to sign in to (default: $GALERTS_EMAIL)')
+    parser.add_argument('--session-file',
+        help='file to keep the session cookies in between runs')
+    parser.add_argument('--format', choices=ALERT_FORMATS, default='jsonl',
+        help='format of the alerts listed and operations applied '
+            '(default: %(default)s)')
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('list', help="write the account's alerts to stdout")
+    def add_fields(command, create=False):
+        if create:
+            command.add_argument('query')
+        else:
+            command.add_argument('--query')
+        command.add_argument('--type', choices=sorted(ALERT_TYPES),
+            default=TYPE_EVERYTHING if create else None)
+        command.add_argument('--deliver', choices=sorted(DELIVER_TYPES),
+            default=DELIVER_FEED if create else None)
+        command.add_argument('--freq', choices=sorted(ALERT_FREQS))
+        command.add_argument('--vol', choices=sorted(ALERT_VOLS))
+    add_fields(commands.add_parser('create', help='create an alert'), True)
+    command = commands.add_parser('update', help='change an alert')
+    command.add_argument('s', help='the id of the alert (its "s" value)')
+    add_fields(command)
+    command = commands.add_parser('delete', help='delete alerts')
+    command.add_argument('s', nargs='+', help='the ids of the alerts')
+    command = commands.add_parser('apply',
+        help='apply the operations in a file')
+    command.add_argument('file', type=argparse.FileType('rb'),
+        help='file of operations, or - for stdin')
+    args = parser.parse_args(argv)
+    if not args.email:
+        parser.error('no --email given')
+
+    if args.command == 'apply':
+        operations = list(_read_operations(args.file, args.format))
+    elif args.command == 'delete':
+        operations = [{'op': 'delete', 's': s} for s in args.s]
+    elif args.command in ('create', 'update'):
+        operations = [dict((field, value) for (field, value)
+            in vars(args).iteritems() if value is not None and
+            field in _MODIFIABLE + ('s',))]
+        operations[0]['op'] = args.command
+        if 'query' in operations[0]:
+            operations[0]['query'] = args.query.decode(
+                getattr(sys.stdin, 'encoding', None) or 'utf-8')
+
+    password = os.environ.get('GALERTS_PASSWORD')
+    if password is None and args.session_file is None:
+        password = getpass('password: ')
+    try:
+        # listings are made at most once, so needn't be cached
+        gam = GAlertsManager(args.email, password, cache_ttl=0,
+            session_file=args.session_file)
+    except SignInError:
+        if password is not None:
+            raise
+        gam = GAlertsManager(args.email, getpass('password: '), cache_ttl=0,
+            session_file=args.session_file)
+    try:
+        if args.command == 'list':
+            write_alerts(gam.alerts, sys.stdout, args.format)
+            return 0
+        failed = _apply_operations(gam, operations)
+    finally:
+        gam.close()
+    for i, op, error in failed:
+        print >> sys.stderr, 'operation %d (%s) failed: %s' % (i + 1, op,
+            error)
+    return 1 if failed else 0
+
+def _interactive():
+    """
+    Prompts for an account to sign in to and what to do with its alerts.
+    """
     import socket
-    import sys
+    from getpass import getpass
     TERMINAL_ENCODING = sys.stdin.encoding
 
     print 'Google Alerts Manager\n'
@@ -659,7 +3986,8 @@ def main():
             if action == 'Quit':
                 break
 
-            alerts = list(gam.alerts)
+            if action != 'Create Alert':
+                alerts = list(gam.alerts)
 
             if action == 'List Alerts':
                 print_alerts(alerts)
@@ -710,4 +4038,4 @@ def main():
         return
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
@@ -45,4 +45,7 @@ setup(
     install_requires=[
         "BeautifulSoup",
         ],
+    entry_points={
+        'console_scripts': ['galerts = galerts:main'],
+        },
     )
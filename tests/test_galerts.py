@@ -0,0 +1,978 @@
+"""
+Tests for galerts, run against ``bench/mockserver.py``::
+
+    $ python -m unittest discover tests
+"""
+
+import httplib
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import urllib2
+from StringIO import StringIO
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, os.pardir))
+sys.path.insert(0, os.path.join(HERE, os.pardir, 'bench'))
+import galerts
+import mockserver
+
+
+def states(alerts):
+    """
+    Returns a list of the state of each of *alerts*, for comparing them.
+    """
+    return [alert.__getstate__() for alert in alerts]
+
+
+class ManagerTestCase(unittest.TestCase):
+    """
+    Runs each test against a fresh :class:`mockserver.MockServer`, with the
+    keyword arguments in :attr:`server_kwds`, and a manager signed in to it.
+    """
+    server_kwds = {}
+
+    def setUp(self):
+        self.server = mockserver.MockServer(**self.server_kwds).start()
+        self.gam = self.manager()
+        with self.server.stats_lock:
+            self.signin_stats = dict(self.server.stats)
+
+    def tearDown(self):
+        self.gam.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def manager(self, password=mockserver.PASSWORD, **kwds):
+        return galerts.GAlertsManager('test', password,
+            accounts_url=self.server.url, alerts_url=self.server.url, **kwds)
+
+    def served(self, name):
+        """
+        Returns the number of *name* requests (e.g. ``'GET /alerts/manage'``)
+        the server has answered since signing in.
+        """
+        with self.server.stats_lock:
+            return self.server.stats.get(name, 0) - \
+                self.signin_stats.get(name, 0)
+
+    def queries(self):
+        """
+        Returns the sorted queries of the alerts the server holds.
+        """
+        return sorted(alert['query']
+            for alert in self.server.account.alerts.itervalues())
+
+
+class TestManager(ManagerTestCase):
+
+    server_kwds = {'alerts': 10}
+
+    def test_sign_in_with_wrong_password(self):
+        self.assertRaises(galerts.SignInError, self.manager, 'wrong')
+
+    def test_list(self):
+        alerts = list(self.gam.alerts)
+        self.assertEqual(sorted(alert.query for alert in alerts),
+            self.queries())
+        for alert in alerts:
+            held = self.server.account.alerts[alert._s]
+            self.assertEqual(galerts.ALERT_TYPES[alert.type], held['type'])
+            self.assertEqual(galerts.ALERT_VOLS[alert.vol], held['vol'])
+            self.assertEqual(alert.feedurl is not None,
+                held['deliver'] == galerts.DELIVER_FEED)
+
+    def test_list_is_cached(self):
+        list(self.gam.alerts)
+        list(self.gam.alerts)
+        self.assertEqual(self.served('GET /alerts/manage'), 1)
+        self.gam.invalidate_cache()
+        self.assertEqual(len(list(self.gam.alerts)), 10)
+        self.assertEqual(self.served('GET /alerts/manage'), 2)
+
+    def test_create(self):
+        list(self.gam.alerts)
+        self.gam.create(u'caf\xe9', galerts.TYPE_NEWS, feed=False,
+            freq=galerts.FREQ_ONCE_A_WEEK)
+        self.assertIn(u'caf\xe9', self.queries())
+        # the cache is invalidated, so the new alert is listed
+        alert, = [a for a in self.gam.alerts if a.query == u'caf\xe9']
+        self.assertEqual(alert.type, galerts.TYPE_NEWS)
+        self.assertEqual(alert.freq, galerts.FREQ_ONCE_A_WEEK)
+        self.assertEqual(alert.deliver, galerts.DELIVER_EMAIL)
+        self.assertEqual(self.served('GET /alerts/manage'), 2)
+
+    def test_update(self):
+        alert = list(self.gam.alerts)[0]
+        alert.query = u'renamed'
+        alert.vol = galerts.VOL_ALL
+        self.gam.update(alert)
+        held = self.server.account.alerts[alert._s]
+        self.assertEqual(held['query'], u'renamed')
+        self.assertEqual(held['vol'], galerts.ALERT_VOLS[galerts.VOL_ALL])
+        # the cached listing is patched rather than fetched again
+        listed = dict((a._s, a) for a in self.gam.alerts)
+        self.assertEqual(listed[alert._s].query, u'renamed')
+        self.assertEqual(listed[alert._s].vol, galerts.VOL_ALL)
+        self.assertEqual(self.served('GET /alerts/manage'), 1)
+
+    def test_update_unmodified(self):
+        alert = list(self.gam.alerts)[0]
+        self.gam.update(alert)
+        self.assertEqual(self.served('POST /alerts/save'), 0)
+
+    def test_delete(self):
+        alert = list(self.gam.alerts)[0]
+        self.gam.delete(alert)
+        self.assertNotIn(alert._s, self.server.account.alerts)
+        # the cached listing is patched rather than fetched again
+        served = self.served('GET /alerts/manage')
+        listed = [a._s for a in self.gam.alerts]
+        self.assertEqual(len(listed), 9)
+        self.assertNotIn(alert._s, listed)
+        self.assertEqual(self.served('GET /alerts/manage'), served)
+
+    def test_batches(self):
+        alerts = list(self.gam.alerts)
+        created = self.gam.create_many([{'query': u'new %d' % i,
+            'type': galerts.TYPE_BLOGS} for i in xrange(5)])
+        self.assertEqual([error for (item, error) in created], [None] * 5)
+        for alert in alerts[:3]:
+            alert.query += u' renamed'
+        updated = self.gam.update_many(alerts[:3])
+        self.assertEqual([error for (item, error) in updated], [None] * 3)
+        deleted = self.gam.delete_many(alerts[3:])
+        self.assertEqual([error for (item, error) in deleted], [None] * 7)
+        expected = sorted([u'new %d' % i for i in xrange(5)] +
+            [alert.query for alert in alerts[:3]])
+        self.assertEqual(self.queries(), expected)
+        self.assertEqual(sorted(a.query for a in self.gam.alerts), expected)
+
+    def test_batch_network_error(self):
+        def fail_third(url, data=None, **kwds):
+            if data and 'q=new+3' in data:
+                raise urllib2.URLError(socket.error(104, 'Connection reset'))
+            return self.gam.__class__._open(self.gam, url, data, **kwds)
+        self.gam._open = fail_third
+        created = self.gam.create_many([{'query': u'new %d' % i,
+            'type': galerts.TYPE_NEWS} for i in xrange(6)])
+        errors = [error for (item, error) in created]
+        self.assertIsInstance(errors.pop(3), urllib2.URLError)
+        self.assertEqual(errors, [None] * 5)
+        self.assertEqual(len(self.queries()), 15)
+
+    def test_sync(self):
+        alerts = list(self.gam.alerts)
+        new = galerts.Alert(self.gam.email, None, u'new', galerts.TYPE_NEWS,
+            galerts.FREQ_AS_IT_HAPPENS, galerts.VOL_ALL, galerts.DELIVER_FEED)
+        created, updated, deleted = self.gam.sync(alerts[:4] + [new])
+        self.assertEqual((len(created), len(updated), len(deleted)),
+            (1, 0, 6))
+        self.assertEqual(self.queries(),
+            sorted([alert.query for alert in alerts[:4]] + [u'new']))
+        self.assertEqual(self.gam.sync(alerts[:4] + [new]), ([], [], []))
+
+
+class TestAlertTable(ManagerTestCase):
+
+    server_kwds = {'alerts': 12}
+
+    def setUp(self):
+        ManagerTestCase.setUp(self)
+        self.alerts = list(self.gam.alerts)
+        self.table = galerts.AlertTable(self.alerts)
+
+    def test_rows(self):
+        self.assertEqual(len(self.table), 12)
+        self.assertEqual(states(self.table), states(self.alerts))
+        self.assertEqual(self.table.column('query'),
+            [alert.query for alert in self.alerts])
+
+    def test_count_and_group(self):
+        self.assertEqual(self.table.count_by('deliver'),
+            {galerts.DELIVER_FEED: 6, galerts.DELIVER_EMAIL: 6})
+        self.assertEqual(self.table.count_by('type'),
+            dict((type, 2) for type in galerts.ALERT_TYPES))
+        groups = self.table.group_by('type')
+        self.assertEqual(sorted(groups), sorted(galerts.ALERT_TYPES))
+        for type, group in groups.iteritems():
+            self.assertEqual(group.column('type'), [type, type])
+
+    def test_filter(self):
+        feeds = self.table.filter(deliver=galerts.DELIVER_FEED,
+            query=lambda query: query != u'alert 1')
+        self.assertEqual(feeds.column('feedurl'), [alert.feedurl
+            for alert in self.alerts[3::2]])
+        self.assertEqual(len(self.table.filter(
+            type=(galerts.TYPE_NEWS, galerts.TYPE_BLOGS))), 4)
+        self.assertEqual(len(self.table.filter(query=u'nothing')), 0)
+
+    def test_duplicates(self):
+        self.gam.create(u'Alert  0', self.alerts[0].type, feed=False)
+        table = galerts.AlertTable(self.gam.alerts)
+        duplicates = table.duplicates()
+        self.assertEqual(len(duplicates), 1)
+        self.assertEqual(sorted(table[i].query for i in duplicates[0]),
+            [u'Alert  0', u'alert 0'])
+        self.assertEqual(len(table.dedupe()), 12)
+
+    def test_csv_and_json(self):
+        for dump, load in ((self.table.to_csv, galerts.AlertTable.from_csv),
+                (self.table.to_json, galerts.AlertTable.from_json)):
+            f = StringIO()
+            dump(f)
+            f.seek(0)
+            self.assertEqual(states(load(f)), states(self.alerts))
+
+
+class TestExportImport(ManagerTestCase):
+
+    server_kwds = {'alerts': 4}
+
+    def setUp(self):
+        ManagerTestCase.setUp(self)
+        self.dir = tempfile.mkdtemp()
+        self.checkpoint = os.path.join(self.dir, 'checkpoint')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        ManagerTestCase.tearDown(self)
+
+    def export(self, format='jsonl'):
+        f = StringIO()
+        self.assertEqual(self.gam.export_alerts(f, format), 4)
+        f.seek(0)
+        return f
+
+    def test_round_trip(self):
+        for format in galerts.ALERT_FORMATS:
+            alerts = list(galerts.read_alerts(self.export(format), format))
+            self.assertEqual(states(alerts), states(self.gam.alerts))
+
+    def test_import(self):
+        f = self.export()
+        results = self.gam.import_alerts(f, batch_size=3)
+        self.assertEqual([error for (alert, error) in results], [None] * 4)
+        self.assertEqual(self.queries(), sorted(2 * ['alert 0', 'alert 1',
+            'alert 2', 'alert 3']))
+
+    def test_resume(self):
+        f = self.export()
+        created = []
+        def create(sig, query, **kwds):
+            if len(created) == 2:
+                raise RuntimeError('interrupted')
+            created.append(query)
+            return galerts.GAlertsManager._create(self.gam, sig, query,
+                **kwds)
+        self.gam._create = create
+        self.assertRaises(RuntimeError, self.gam.import_alerts, f,
+            checkpoint=self.checkpoint, batch_size=1)
+        del self.gam._create
+        f.seek(0)
+        results = self.gam.import_alerts(f, checkpoint=self.checkpoint)
+        self.assertEqual([alert.query for (alert, error) in results],
+            [u'alert 2', u'alert 3'])
+        self.assertEqual(self.queries(), sorted(2 * ['alert 0', 'alert 1',
+            'alert 2', 'alert 3']))
+        f.seek(0)
+        self.assertEqual(self.gam.import_alerts(f,
+            checkpoint=self.checkpoint), [])
+
+    def test_resume_after_partial_line(self):
+        # the log was cut off while "1\n" was being written
+        with open(self.checkpoint, 'w') as log:
+            log.write('0\n1')
+        results = self.gam.import_alerts(self.export(),
+            checkpoint=self.checkpoint)
+        self.assertEqual([alert.query for (alert, error) in results],
+            [u'alert 1', u'alert 2', u'alert 3'])
+        with open(self.checkpoint) as log:
+            self.assertEqual(sorted(log.read().split('\n')),
+                ['', '0', '1', '2', '3'])
+
+
+class TestFeedFetcher(ManagerTestCase):
+
+    server_kwds = {'alerts': 6}
+
+    def setUp(self):
+        ManagerTestCase.setUp(self)
+        self.events = []
+        self.gam.hooks.append(self.events.append)
+        self.fetcher = galerts.FeedFetcher(self.gam)
+        self.feeds = [alert for alert in self.gam.alerts
+            if alert.deliver == galerts.DELIVER_FEED]
+
+    def tearDown(self):
+        self.fetcher.close()
+        ManagerTestCase.tearDown(self)
+
+    def feed_statuses(self):
+        statuses = sorted(event.status for event in self.events
+            if event.op == 'feed')
+        del self.events[:]
+        return statuses
+
+    def test_fetch(self):
+        results = list(self.fetcher.fetch())
+        self.assertEqual(self.fetcher.errors, [])
+        # each of the three feeds has five results of its own and one it
+        # shares with an email alert
+        self.assertEqual(len(results), 18)
+        self.assertEqual(sorted(set(alert._s for (alert, entry) in results)),
+            sorted(alert._s for alert in self.feeds))
+        for alert, entry in results:
+            self.assertTrue(entry.title.startswith(u'Result'))
+            self.assertTrue(entry.link.startswith(self.server.url))
+        self.assertEqual(self.feed_statuses(), [200] * 3)
+        # the feeds haven't changed, so they're revalidated
+        self.assertEqual(list(self.fetcher.fetch()), [])
+        self.assertEqual(self.feed_statuses(), [304] * 3)
+
+    def test_seen(self):
+        results = list(self.fetcher.fetch())
+        self.fetcher.validators.clear()
+        self.assertEqual(list(self.fetcher.fetch()), [])
+        self.assertEqual(self.feed_statuses(), [200] * 6)
+        self.assertEqual(len(self.fetcher.seen), len(results))
+
+    def test_errors(self):
+        self.server.account.delete(self.feeds[0]._s)
+        results = list(self.fetcher.fetch(self.feeds))
+        self.assertEqual(len(results), 12)
+        (alert, error), = self.fetcher.errors
+        self.assertIs(alert, self.feeds[0])
+        self.assertEqual(error.resp_status, 404)
+
+
+class TestFeedPoller(ManagerTestCase):
+
+    server_kwds = {'alerts': 6, 'feed_period': 1}
+
+    def setUp(self):
+        ManagerTestCase.setUp(self)
+        self.dir = tempfile.mkdtemp()
+        self.state_file = os.path.join(self.dir, 'state.json')
+        self.pollers = []
+
+    def tearDown(self):
+        for poller in self.pollers:
+            poller.close()
+        shutil.rmtree(self.dir)
+        ManagerTestCase.tearDown(self)
+
+    def poller(self, **kwds):
+        kwds.setdefault('min_interval', 0.5)
+        kwds.setdefault('max_interval', 10)
+        poller = galerts.FeedPoller(self.gam, self.state_file, **kwds)
+        self.pollers.append(poller)
+        return poller
+
+    def test_poll(self):
+        poller = self.poller()
+        self.assertEqual(len(poller.poll()), 18)
+        self.assertEqual(poller.errors, [])
+        served = self.served('GET /alerts/feeds')
+        self.assertEqual(served, 3)
+        # each feed gets a new result every one to three seconds, so is
+        # polled about as often, but no more often than every half second
+        wait = poller.next_poll()
+        self.assertTrue(0.5 <= wait <= 3, wait)
+        self.assertEqual(poller.poll(), [])
+        self.assertEqual(self.served('GET /alerts/feeds'), served)
+        time.sleep(wait)
+        poller.poll()
+        self.assertGreater(self.served('GET /alerts/feeds'), served)
+
+    def test_state_file(self):
+        self.poller().poll()
+        served = self.served('GET /alerts/feeds')
+        # a new poller carries on with the saved schedule
+        poller = self.poller()
+        self.assertEqual(poller.poll(), [])
+        self.assertEqual(self.served('GET /alerts/feeds'), served)
+
+    def test_refresh(self):
+        poller = self.poller(refresh_interval=0)
+        poller.poll()
+        self.gam.create(u'new feed', galerts.TYPE_NEWS)
+        results = poller.poll()
+        self.assertEqual(set(alert.query for (alert, entry) in results),
+            set([u'new feed']))
+
+
+class TestConditionalRequests(ManagerTestCase):
+
+    server_kwds = {'alerts': 200, 'page_size': 100}
+
+    def setUp(self):
+        ManagerTestCase.setUp(self)
+        self.events = []
+        self.gam.hooks.append(self.events.append)
+
+    def statuses(self, op):
+        statuses = [event.status for event in self.events if event.op == op]
+        del self.events[:]
+        return statuses
+
+    def test_compressed(self):
+        alerts = list(self.gam.alerts)
+        sent = []
+        for gzip in (True, False):
+            self.server.gzip = gzip
+            gam = self.manager()
+            before = self.served('bytes')
+            self.assertEqual(states(gam.alerts), states(alerts))
+            sent.append(self.served('bytes') - before)
+            gam.close()
+        compressed, uncompressed = sent
+        self.assertLess(compressed * 3, uncompressed)
+
+    def test_listing_revalidated(self):
+        alerts = list(self.gam.alerts)
+        self.assertEqual(self.statuses('list'), [200, 200])
+        self.gam.invalidate_cache()
+        self.assertEqual(states(self.gam.alerts), states(alerts))
+        self.assertEqual(self.statuses('list'), [304, 304])
+        # only the page that changed is downloaded again
+        self.server.account.delete(alerts[-1]._s)
+        self.gam.invalidate_cache()
+        self.assertEqual(states(self.gam.alerts), states(alerts[:-1]))
+        self.assertEqual(sorted(self.statuses('list')), [200, 200])
+
+    def test_edit_page_revalidated(self):
+        alert = list(self.gam.alerts)[0]
+        for query in (u'renamed', u'renamed again'):
+            alert.query = query
+            self.gam.update(alert)
+        self.assertEqual(self.statuses('scrape edit page'), [200, 304])
+        self.assertEqual(self.server.account.alerts[alert._s]['query'],
+            u'renamed again')
+
+
+class TestCommandLine(ManagerTestCase):
+
+    server_kwds = {'alerts': 4}
+
+    def setUp(self):
+        ManagerTestCase.setUp(self)
+        self.dir = tempfile.mkdtemp()
+        self.alerts = list(self.gam.alerts)
+        server = self.server
+        manager_class = galerts.GAlertsManager
+        class MockManager(manager_class):
+            def __init__(self, email, password, **kwds):
+                kwds.update(accounts_url=server.url, alerts_url=server.url)
+                manager_class.__init__(self, email, password, **kwds)
+        self.saved = (galerts.GAlertsManager, sys.stdout, sys.stderr,
+            os.environ.get('GALERTS_PASSWORD'))
+        galerts.GAlertsManager = MockManager
+        os.environ['GALERTS_PASSWORD'] = mockserver.PASSWORD
+
+    def tearDown(self):
+        galerts.GAlertsManager, sys.stdout, sys.stderr, password = self.saved
+        if password is None:
+            del os.environ['GALERTS_PASSWORD']
+        else:
+            os.environ['GALERTS_PASSWORD'] = password
+        shutil.rmtree(self.dir)
+        ManagerTestCase.tearDown(self)
+
+    def run_command(self, *args):
+        """
+        Runs ``galerts --email test`` with *args*, and returns its exit
+        status and what it wrote to stdout and stderr.
+        """
+        sys.stdout, sys.stderr = StringIO(), StringIO()
+        try:
+            status = galerts.main(['--email', 'test'] + list(args))
+            return status, sys.stdout.getvalue(), sys.stderr.getvalue()
+        finally:
+            sys.stdout, sys.stderr = self.saved[1:3]
+
+    def write(self, name, content):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_list(self):
+        status, out, err = self.run_command('list')
+        self.assertEqual(status, 0)
+        self.assertEqual(states(galerts.read_alerts(StringIO(out))),
+            states(self.alerts))
+        status, out, err = self.run_command('--format', 'csv', 'list')
+        self.assertEqual(states(galerts.read_alerts(StringIO(out), 'csv')),
+            states(self.alerts))
+
+    def test_create_update_delete(self):
+        self.assertEqual(self.run_command('create', 'caf\xc3\xa9',
+            '--type', galerts.TYPE_BLOGS, '--deliver', galerts.DELIVER_EMAIL,
+            '--freq', galerts.FREQ_ONCE_A_WEEK), (0, '', ''))
+        held, = [alert for alert in self.server.account.alerts.itervalues()
+            if alert['query'] == u'caf\xe9']
+        self.assertEqual(held['freq'],
+            galerts.ALERT_FREQS[galerts.FREQ_ONCE_A_WEEK])
+        self.assertEqual(self.run_command('update', self.alerts[0]._s,
+            '--query', 'renamed'), (0, '', ''))
+        self.assertEqual(
+            self.server.account.alerts[self.alerts[0]._s]['query'],
+            u'renamed')
+        status, out, err = self.run_command('delete', self.alerts[1]._s,
+            'missing')
+        self.assertEqual(status, 1)
+        self.assertIn("operation 2 (delete) failed: No alert with s='missing'",
+            err)
+        self.assertNotIn(self.alerts[1]._s, self.server.account.alerts)
+
+    def test_apply(self):
+        path = self.write('ops.jsonl', '\n'.join([
+            '{"op": "create", "query": "new", "type": "News"}',
+            '{"op": "update", "s": "%s", "vol": "All results"}'
+                % self.alerts[0]._s,
+            '{"op": "frob"}',
+            '{"op": "delete", "s": "%s"}' % self.alerts[1]._s,
+            ]) + '\n')
+        listed = self.served('GET /alerts/manage')
+        status, out, err = self.run_command('apply', path)
+        self.assertEqual(status, 1)
+        self.assertIn('operation 3 (frob) failed', err)
+        self.assertIn(u'new', self.queries())
+        self.assertEqual(self.server.account.alerts[self.alerts[0]._s]['vol'],
+            galerts.ALERT_VOLS[galerts.VOL_ALL])
+        self.assertNotIn(self.alerts[1]._s, self.server.account.alerts)
+        # one sign in, which lands on the manage page, one listing, and one
+        # signature for the whole batch
+        self.assertEqual(self.served('POST /ServiceLoginAuth'), 1)
+        self.assertEqual(self.served('GET /alerts/manage') - listed, 3)
+
+    def test_apply_csv(self):
+        path = self.write('ops.csv', 'op,s,query,type\n'
+            'create,,csv query,Blogs\ndelete,%s,,\n' % self.alerts[0]._s)
+        self.assertEqual(self.run_command('--format', 'csv', 'apply', path),
+            (0, '', ''))
+        self.assertIn(u'csv query', self.queries())
+        self.assertNotIn(self.alerts[0]._s, self.server.account.alerts)
+
+
+class TestAlertIndex(ManagerTestCase):
+
+    server_kwds = {'alerts': 6}
+
+    def setUp(self):
+        ManagerTestCase.setUp(self)
+        self.alerts = list(self.gam.alerts)
+
+    def test_lookups(self):
+        index = self.gam.index
+        self.assertEqual(len(index), 6)
+        self.assertEqual(states(index), states(self.alerts))
+        for alert in self.alerts:
+            self.assertIn(alert._s, index)
+            self.assertEqual(states([index.get_by_id(alert._s)]),
+                states([alert]))
+            if alert.feedurl:
+                self.assertEqual(index.find_by_feed(alert.feedurl)._s,
+                    alert._s)
+        self.assertIs(index.get_by_id('missing'), None)
+        self.assertIs(index.find_by_feed('http://example.com/'), None)
+        self.assertEqual([a._s for a in index.find_by_query(u' ALERT  2')],
+            [self.alerts[2]._s])
+        found = index.find_by_type(self.alerts[1].type, galerts.DELIVER_FEED)
+        self.assertEqual([a._s for a in found], [self.alerts[1]._s])
+        self.assertEqual(index.find_by_type(self.alerts[1].type,
+            galerts.DELIVER_EMAIL), [])
+        # the index was built from the cached listing
+        self.assertEqual(self.served('GET /alerts/manage'), 1)
+
+    def test_copies(self):
+        index = self.gam.index
+        index.get_by_id(self.alerts[0]._s).query = u'changed'
+        self.assertEqual(index.get_by_id(self.alerts[0]._s).query,
+            self.alerts[0].query)
+        self.assertEqual(index.find_by_query(u'changed'), [])
+
+    def test_kept_current(self):
+        alert = self.gam.index.get_by_id(self.alerts[0]._s)
+        alert.query = u'renamed'
+        self.gam.update(alert)
+        self.gam.delete(self.alerts[1])
+        index = self.gam.index
+        self.assertEqual([a._s for a in index.find_by_query(u'renamed')],
+            [alert._s])
+        self.assertEqual(index.find_by_query(self.alerts[0].query), [])
+        self.assertNotIn(self.alerts[1]._s, index)
+        self.assertIs(index.find_by_feed(self.alerts[1].feedurl), None)
+        # the listing and the deletion's signature, but no new listing
+        self.assertEqual(self.served('GET /alerts/manage'), 2)
+        self.gam.create(u'created', galerts.TYPE_NEWS)
+        created, = self.gam.index.find_by_query(u'created')
+        self.assertEqual(self.gam.index.find_by_feed(created.feedurl)._s,
+            created._s)
+
+
+class TestRedirectedCreate(ManagerTestCase):
+
+    server_kwds = {'alerts': 3, 'redirect_creates': True}
+
+    def test_create(self):
+        list(self.gam.alerts)
+        self.gam.create(u'redirected', galerts.TYPE_NEWS)
+        self.assertIn(u'redirected', [a.query for a in self.gam.alerts])
+        self.assertEqual(len(list(self.gam.alerts)), 4)
+
+
+class TestPagination(ManagerTestCase):
+
+    server_kwds = {'alerts': 10, 'page_size': 4}
+
+    def test_list(self):
+        alerts = list(self.gam.alerts)
+        self.assertEqual(sorted(a.query for a in alerts), self.queries())
+        self.assertEqual(len(set(a._s for a in alerts)), 10)
+        self.assertEqual(self.served('GET /alerts/manage'), 3)
+
+    def test_delete(self):
+        alerts = list(self.gam.alerts)
+        self.gam.delete(alerts[5])
+        self.gam.invalidate_cache()
+        listed = [a._s for a in self.gam.alerts]
+        self.assertEqual(len(listed), 9)
+        self.assertNotIn(alerts[5]._s, listed)
+
+
+class TestRetries(ManagerTestCase):
+
+    server_kwds = {'alerts': 3}
+
+    def setUp(self):
+        ManagerTestCase.setUp(self)
+        self.gam.retry_policy = galerts.RetryPolicy(retries=2, backoff=0.01)
+
+    def test_list_retried(self):
+        self.server.fail(503, times=2)
+        self.assertEqual(len(list(self.gam.alerts)), 3)
+        self.assertEqual(self.served('GET /alerts/manage'), 3)
+
+    def test_retries_exhausted(self):
+        self.server.fail(503, times=3)
+        try:
+            list(self.gam.alerts)
+        except galerts.UnexpectedResponseError, e:
+            self.assertEqual(e.resp_status, 503)
+        else:
+            self.fail('UnexpectedResponseError not raised')
+        self.assertEqual(self.served('GET /alerts/manage'), 3)
+
+    def test_create_not_retried(self):
+        self.server.fail(503, path='/alerts/create')
+        self.assertRaises(galerts.UnexpectedResponseError, self.gam.create,
+            u'second', galerts.TYPE_NEWS)
+        self.assertEqual(self.served('POST /alerts/create'), 1)
+        self.assertNotIn(u'second', self.queries())
+
+    def test_create_retried_after_429(self):
+        self.server.fail(429, retry_after=0, path='/alerts/create')
+        self.gam.create(u'second', galerts.TYPE_NEWS)
+        self.assertEqual(self.served('POST /alerts/create'), 2)
+        self.assertEqual(self.queries().count(u'second'), 1)
+
+    def test_long_retry_after(self):
+        self.server.fail(503, retry_after=3600)
+        self.assertRaises(galerts.UnexpectedResponseError, list,
+            self.gam.alerts)
+        self.assertEqual(self.served('GET /alerts/manage'), 1)
+
+    def test_circuit_breaker(self):
+        breaker = galerts.CircuitBreaker(threshold=2, reset_timeout=0.05)
+        gam = self.manager(circuit_breaker=breaker, cache_ttl=0,
+            retry_policy=None)
+        self.server.fail(503, times=2)
+        for i in xrange(2):
+            self.assertRaises(galerts.UnexpectedResponseError, list,
+                gam.alerts)
+        served = self.served('GET /alerts/manage')
+        self.assertRaises(galerts.CircuitOpenError, list, gam.alerts)
+        self.assertEqual(self.served('GET /alerts/manage'), served)
+        time.sleep(0.1)
+        self.assertEqual(len(list(gam.alerts)), 3)
+        self.assertEqual(breaker.state, 'closed')
+        gam.close()
+
+
+class TestRateLimits(ManagerTestCase):
+
+    server_kwds = {'alerts': 3}
+
+    def list_limited(self, limiters):
+        """
+        Lists the alerts three times with each of two managers, limited by
+        one of *limiters* each, and returns how long that took.
+        """
+        managers = [self.manager(cache_ttl=0) for limiter in limiters]
+        for gam, limiter in zip(managers, limiters):
+            gam.rate_limiters.append(limiter)
+        start = time.time()
+        for i in xrange(3):
+            for gam in managers:
+                self.assertEqual(len(list(gam.alerts)), 3)
+        elapsed = time.time() - start
+        for gam in managers:
+            gam.close()
+        return elapsed
+
+    def test_shared_bucket(self):
+        bucket = galerts.TokenBucket(20)
+        # the first request takes the one token of the burst, and each of
+        # the other five waits for a new one
+        self.assertGreaterEqual(self.list_limited([bucket, bucket]), 0.24)
+
+    def test_file_bucket(self):
+        # processes sharing a file share one limit
+        dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(dir, 'bucket')
+            limiters = [galerts.FileTokenBucket(path, 20, burst=2)
+                for i in xrange(2)]
+            self.assertGreaterEqual(self.list_limited(limiters), 0.19)
+        finally:
+            shutil.rmtree(dir)
+
+    def test_bucket(self):
+        bucket = galerts.TokenBucket(10, burst=2)
+        self.assertTrue(bucket.take())
+        self.assertTrue(bucket.take())
+        self.assertFalse(bucket.take())
+        self.assertTrue(0.05 < bucket.delay() <= 0.1)
+
+
+class TestCircuitBreaker(ManagerTestCase):
+
+    server_kwds = {'alerts': 3}
+
+    def half_open(self, breaker):
+        breaker.failed()
+        time.sleep(breaker.reset_timeout * 1.5)
+        self.assertEqual(breaker.state, 'half-open')
+
+    def test_abandoned_trial(self):
+        breaker = galerts.CircuitBreaker(threshold=1, reset_timeout=0.05)
+        gam = self.manager(circuit_breaker=breaker, cache_ttl=0)
+        self.half_open(breaker)
+
+        class FailingLimiter(object):
+            def acquire(self):
+                raise OSError('lock failed')
+        gam.rate_limiters = [FailingLimiter()]
+        self.assertRaises(OSError, list, gam.alerts)
+        self.assertEqual(breaker.state, 'half-open')
+        gam.rate_limiters = []
+
+        def interrupt(*args, **kwds):
+            raise KeyboardInterrupt
+        gam._attempt = interrupt
+        self.assertRaises(KeyboardInterrupt, list, gam.alerts)
+        self.assertEqual(breaker.state, 'half-open')
+        del gam._attempt
+
+        self.assertEqual(len(list(gam.alerts)), 3)
+        self.assertEqual(breaker.state, 'closed')
+        gam.close()
+
+
+def make_alert(s, query, type=galerts.TYPE_NEWS, vol=galerts.VOL_ONLY_BEST,
+        deliver=galerts.DELIVER_FEED, freq=galerts.FREQ_AS_IT_HAPPENS,
+        email='test@gmail.com'):
+    return galerts.Alert(email, s, query, type, freq, vol, deliver)
+
+
+class TestRedundancy(unittest.TestCase):
+
+    def redundant(self, alerts):
+        return sorted((r.alert._s, r.kind, r.covered_by._s)
+            for r in galerts.find_redundant_alerts(alerts))
+
+    def test_equivalent(self):
+        alerts = [make_alert('1', u'apple pie'),
+            make_alert('2', u'Apple  "pie"'), make_alert('3', u'pie apple')]
+        self.assertEqual(self.redundant(alerts),
+            [('2', 'exact', '1'), ('3', 'reordered', '1')])
+
+    def test_subsumed(self):
+        alerts = [make_alert('1', u'apple pie'), make_alert('2', u'apple'),
+            make_alert('3', u'apple OR cake'), make_alert('4', u'cake'),
+            make_alert('5', u'"apple pie"')]
+        self.assertEqual(self.redundant(alerts),
+            [('1', 'subsumed', '3'), ('2', 'subsumed', '3'),
+             ('4', 'subsumed', '3')])
+
+    def test_only_covered_by_same_kind(self):
+        alerts = [make_alert('1', u'apple pie'),
+            make_alert('2', u'apple', type=galerts.TYPE_BLOGS),
+            make_alert('3', u'apple', deliver=galerts.DELIVER_EMAIL,
+                freq=galerts.FREQ_ONCE_A_DAY),
+            make_alert('4', u'apple pie', vol=galerts.VOL_ALL)]
+        self.assertEqual(self.redundant(alerts), [('4', 'exact', '1')])
+
+    def test_grouped_queries(self):
+        alerts = [make_alert('1', u'(apple pie) OR cake'),
+            make_alert('2', u'apple'), make_alert('3', u'cake'),
+            make_alert('4', u'(Apple  pie) OR cake')]
+        self.assertEqual(self.redundant(alerts), [('4', 'exact', '1')])
+
+    def test_consolidate(self):
+        alerts = [make_alert('1', u'apple pie'),
+            make_alert('2', u'apple  pie', vol=galerts.VOL_ALL),
+            make_alert('3', u'apple pie cake'),
+            make_alert('4', u'(apple pie) OR cake')]
+        to_update, to_delete = galerts.consolidate_alerts(alerts)
+        # the alert kept takes on the volume of the one deleted
+        self.assertEqual([(a._s, a.vol) for a in to_update],
+            [('1', galerts.VOL_ALL)])
+        self.assertEqual(alerts[0].vol, galerts.VOL_ONLY_BEST)
+        self.assertEqual(sorted(a._s for a in to_delete), ['2', '3'])
+
+
+class TestConsolidation(ManagerTestCase):
+
+    server_kwds = {'alerts': 2}
+
+    def test_consolidate(self):
+        feed = list(self.gam.alerts)[1]
+        for query, vol in ((u'Alert  1', galerts.VOL_ALL),
+                (u'alert 1 extra', galerts.VOL_ONLY_BEST),
+                (u'(alert 1) OR cake', galerts.VOL_ONLY_BEST)):
+            self.gam.create(query, feed.type, vol=vol)
+        to_update, to_delete = galerts.consolidate_alerts(self.gam.alerts)
+        updated = self.gam.update_many(to_update)
+        self.assertEqual([error for (alert, error) in updated], [None])
+        deleted = self.gam.delete_many(to_delete)
+        self.assertEqual([error for (alert, error) in deleted], [None, None])
+        self.gam.invalidate_cache()
+        alerts = dict((alert.query, alert) for alert in self.gam.alerts)
+        self.assertEqual(sorted(alerts),
+            [u'(alert 1) OR cake', u'alert 0', u'alert 1'])
+        self.assertEqual(alerts[u'alert 1'].vol, galerts.VOL_ALL)
+        self.assertEqual(galerts.consolidate_alerts(alerts.values()),
+            ([], []))
+
+
+class TestManagerPool(unittest.TestCase):
+
+    class Manager(object):
+        def __init__(self, email):
+            self.email = email
+            self.rate_limiters = []
+
+        def close(self):
+            pass
+
+    def test_one_operation_per_account(self):
+        pool = galerts.GAlertsManagerPool(workers=4)
+        running = {}
+        most = {}
+        order = []
+        lock = threading.Lock()
+        def op(manager, i):
+            with lock:
+                running[manager.email] = running.get(manager.email, 0) + 1
+                most[manager.email] = max(most.get(manager.email, 0),
+                    running[manager.email])
+            time.sleep(0.005)
+            with lock:
+                running[manager.email] -= 1
+                order.append((manager.email, i))
+            return i
+        for email in 'ab':
+            pool.add_manager(self.Manager(email))
+        tasks = [pool.submit(email, op, i) for i in xrange(10)
+            for email in 'ab']
+        self.assertEqual([task.get() for task in tasks],
+            [i for i in xrange(10) for email in 'ab'])
+        pool.close()
+        self.assertEqual(most, {'a': 1, 'b': 1})
+        for email in 'ab':
+            self.assertEqual([i for (e, i) in order if e == email],
+                range(10))
+
+
+class TestKeepAlive(unittest.TestCase):
+    """
+    Checks which requests are sent again after failing on a pooled
+    connection, using connections that never get a response.
+    """
+
+    class Connection(object):
+        sent = []
+        tunnels = []
+
+        def __init__(self, host, timeout=None):
+            self.sock = None
+
+        def set_tunnel(self, host, headers=None):
+            self.tunnels.append((host, headers))
+
+        def connect(self):
+            self.sock, self.peer = socket.socketpair()
+
+        def request(self, method, selector, data, headers):
+            self.sent.append((method, headers.get('Proxy-Authorization')))
+
+        def getresponse(self):
+            raise httplib.BadStatusLine('')
+
+        def close(self):
+            pass
+
+    def setUp(self):
+        del self.Connection.sent[:], self.Connection.tunnels[:]
+        self.pool = galerts._ConnectionPool(2)
+        self.handler = galerts._KeepAliveMixin(self.pool, threading.local())
+
+    def open(self, req):
+        req.timeout = 5
+        host = req.get_host()
+        idle = self.Connection(host)
+        idle.connect()
+        self.pool.put((self.Connection, host, req._tunnel_host), idle)
+        self.assertRaises(urllib2.URLError, self.handler._keepalive_open,
+            self.Connection, req)
+        return [method for (method, auth) in self.Connection.sent]
+
+    def test_get_sent_again(self):
+        self.assertEqual(self.open(urllib2.Request('http://h/')),
+            ['GET', 'GET'])
+
+    def test_post_not_sent_again(self):
+        self.assertEqual(self.open(urllib2.Request('http://h/', 'q=x')),
+            ['POST'])
+
+    def test_closed_connection_not_reused(self):
+        idle = self.Connection('h')
+        idle.connect()
+        idle.peer.close()
+        self.pool.put('key', idle)
+        self.assertIs(self.pool.get('key'), None)
+
+    def test_tunnel(self):
+        req = urllib2.Request('https://real/')
+        req.get_host()
+        req.set_proxy('proxy:3128', 'https')
+        req.add_header('Proxy-Authorization', 'Basic eA==')
+        req.timeout = 5
+        self.assertRaises(urllib2.URLError, self.handler._keepalive_open,
+            self.Connection, req)
+        self.assertEqual(self.Connection.tunnels,
+            [('real', {'Proxy-Authorization': 'Basic eA=='})])
+        # the credentials are for the proxy, not the real host
+        self.assertEqual(self.Connection.sent, [('GET', None)])
+
+
+if __name__ == '__main__':
+    unittest.main()